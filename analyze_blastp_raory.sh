@@ -38,7 +38,7 @@ cp $roary_run"/gene_presence_absence.csv" $outdir"/"$name"_cluster_presence_abse
 # Simulate adding strains to the pan genome in different orders
 cutoffs="0.15,0.95,0.99,1.0" #graph needs more colors to increase this
 num_simulations=5
-python simulate_pan_genome.py $roary_run $outdir $name $cutoffs $num_simulations
+python3 simulate_pan_genome.py $roary_run $outdir $name $cutoffs $num_simulations
 python plot_rtab.py $roary_run $outdir $name
 
 
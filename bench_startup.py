@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Author:  Rachel Ehrlich
+Measures how long importing each script takes in a fresh interpreter, which
+is what every short invocation (ex get_fsgm_input.py inside the backticks in
+analyze_blastp_raory.sh, or an argument error) pays before main() runs.  Each
+script is imported --repeat times and the median is compared to --budget.
+The heavy libraries each import left loaded are listed, they should only be
+loaded once a script uses them.  Exits with 1 if a script is over budget,
+loads a heavy library or fails to import.
+python bench_startup.py --python python3 --budget 0.1
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPTS = ['find_paralogs', 'get_fsgm_input', 'get_roary_core',
+           'pairwise_outliers', 'pairwise_table', 'plot_batch',
+           'plot_blastp_comparison', 'plot_fsgm_results', 'plot_rtab',
+           'roary_analysis', 'roary_version_fix', 'run_pipeline',
+           'simulate_pan_genome', 'tree_heatmap']
+HEAVY_MODULES = ['numpy', 'matplotlib', 'seaborn', 'pandas', 'Bio', 'scipy']
+
+# Run in the fresh interpreter, prints the import time and the heavy modules
+# loaded
+TIMER = '''
+import sys, time
+start = time.time()
+import %s
+seconds = time.time() - start
+heavy = [x for x in %r if x in sys.modules]
+sys.stdout.write('%%.6f %%s\\n' %% (seconds, ','.join(heavy)))
+'''
+
+
+# Inputs are the python to run and a script's module name
+# Returns the seconds the import took and the heavy modules it loaded
+def time_import(python, module):
+    output = subprocess.check_output(
+        [python, '-c', TIMER % (module, HEAVY_MODULES)], cwd=SCRIPT_DIR,
+        stderr=subprocess.STDOUT)
+    fields = output.decode().strip().split('\n')[-1].split(' ')
+    heavy = [x for x in fields[1:] if len(x) > 0]
+    return float(fields[0]), heavy
+
+
+# Input is a list of numbers
+# Returns their median
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+# Inputs are the python to run, a module name and the number of imports
+# Returns the median import seconds, the heavy modules loaded and an error
+# message (None if the script imported)
+def bench_script(python, module, repeat):
+    times = list()
+    heavy = list()
+    for i in range(repeat):
+        try:
+            seconds, heavy = time_import(python, module)
+        except subprocess.CalledProcessError as e:
+            lines = e.output.decode().strip().split('\n')
+            return None, [], lines[-1]
+        times.append(seconds)
+    return median(times), heavy, None
+
+
+def get_options():
+    parser = argparse.ArgumentParser(
+        description='Check the import time of each script against a budget')
+    parser.add_argument('scripts', nargs='*', default=SCRIPTS,
+                        help='module names of the scripts, default all')
+    parser.add_argument('--python', default=sys.executable,
+                        help='python to measure')
+    parser.add_argument('--budget', type=float, default=0.1,
+                        help='most seconds an import may take')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of imports per script')
+    return parser.parse_args()
+
+
+def main():
+    options = get_options()
+    failed = 0
+    sys.stdout.write('script\tseconds\tstatus\theavy_modules\n')
+    for module in options.scripts:
+        module = module[:-3] if module.endswith('.py') else module
+        seconds, heavy, error = bench_script(options.python, module,
+                                             max(1, options.repeat))
+        if error is not None:
+            status = 'error: ' + error
+        elif seconds > options.budget:
+            status = 'over budget'
+        elif len(heavy) > 0:
+            status = 'heavy import'
+        else:
+            status = 'ok'
+        if status != 'ok':
+            failed += 1
+        shown = '' if seconds is None else '%.3f' % seconds
+        sys.stdout.write('%s\t%s\t%s\t%s\n' % (module, shown, status,
+                                                ','.join(heavy)))
+    if failed > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
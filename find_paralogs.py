@@ -13,93 +13,189 @@ written to the input folder.
 paralog_table maps each gene to its paralogs
 summary_statistics_paralogs_merged is like the summary statistics from the
 original output but has the gene counts from before splitting paralogs.
+The cutoffs between cloud, shell, soft core and core can be changed with
+--cutoffs.  gene_presence_absence_paralogs_merged.Rtab is also written to the
+input folder.
 """
-import numpy as np
-from sys import argv, maxint
-from itertools import izip
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from array import array
+import roary_reader as rr
+from lazy_import import LazyModule
+
+np = LazyModule('numpy')
+
+
+# Input is a list of gene names
+# Returns them as utf-8 bytes, each followed by a newline
+def encode_names(names):
+    text = '\n'.join(names) + '\n'
+    if sys.version_info[0] >= 3:
+        text = text.encode('utf-8')
+    return text
+
+
+# Input is a bytearray of names, each followed by a newline
+# Returns the names as a numpy fixed width bytes array, filled one character
+# position at a time from the buffer instead of making a string per name
+def names_array(blob):
+    chars = np.frombuffer(blob, dtype=np.uint8)
+    ends = np.flatnonzero(chars == ord('\n'))
+    starts = np.concatenate(([0], ends[:-1] + 1)).astype(np.int64)
+    lengths = ends - starts
+    width = max(1, int(lengths.max())) if len(lengths) > 0 else 1
+    table = np.zeros((len(ends), width), dtype=np.uint8)
+    for j in range(width):
+        has_char = lengths > j
+        table[has_char, j] = chars[starts[has_char] + j]
+    return table.view('S%d' % width).reshape(len(ends))
+
+
+class GeneTable(object):
+    """
+    Gene names sorted as one numpy bytes array with the id of each, so genes
+    are looked up with a binary search instead of a dict holding a string
+    object per gene.  A name listed twice maps to its last id, as a dict
+    would.
+    """
+
+    def __init__(self, names):
+        self.order = np.argsort(names, kind='mergesort').astype(np.int32)
+        self.names = names[self.order]
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, names):
+        """
+        :param names: numpy bytes array of gene names
+        :return: int32 array with the id of each name.  Raises KeyError for
+        a name that isn't in the table.
+        """
+        if len(names) == 0:
+            return np.zeros(0, dtype=np.int32)
+        table = self.names
+        if names.dtype.itemsize > table.dtype.itemsize:
+            table = table.astype(names.dtype)
+        pos = np.searchsorted(table, names, side='right') - 1
+        found = (pos >= 0) & (table[np.maximum(pos, 0)] == names)
+        if not found.all():
+            raise KeyError(names[np.argmin(found)].decode('utf-8'))
+        return self.order[pos]
 
 
 # Input is the folder with the roary output files
-# This uses the gene_presence_absence.csv file 
-# Returns the cluster names, a list of lists with the genes
-# from each cluster and a list of lists with all the input data
-def get_pres_abs_data(folder):
-    with open(folder + "/gene_presence_absence.csv", 'rU') as f:
-        lines_end_quotes = f.read().split('\n')
-    lines = [x[1:-1] for x in lines_end_quotes]   
-    
-    # The file is a csv but the annotations contain commas...
-    split_lines = [x.split('","') for x in lines if len(x) > 0]
-    
-    rows = split_lines[1:]
-    cluster_names = [x[0] for x in rows]
-    gene_data = [' '.join(row[11:]).split() for row in rows]
-
-    return cluster_names, np.array(gene_data), np.array(split_lines)
-
-
-# Input is a roary folder
-# Returns the names for the clusters after splitting paralogs
-# Returns two lists of lists with the genes in each cluster
-# (split and unsplit)
-def get_data(folder):
-    cluster_names, split_clusters, all_data = get_pres_abs_data(folder)
-    with open(folder + "/_inflated_unsplit_mcl_groups", 'rU') as f:
-        unsplit_clusters = [x.split()
-                            for x in f.read().split('\n') if len(x) > 0]
-        
-    return cluster_names, split_clusters, np.array(unsplit_clusters)
-
-
-# Input is a list of split clusters names and a list of lists with list
-# i containing the genes in cluster name i.
-# Returns an inverted index that maps the gene name (prokka something) to
-# the gene cluster's name
-def make_split_index(cluster_names, split_clusters):
-    inverted_index = dict()
-    for name, genes in izip(cluster_names, split_clusters):
-        for gene in genes:
-            inverted_index[gene] = name
-    return inverted_index
-
-
-# Input: inverted index that maps the gene name (prokka something) to
-# the gene cluster's name, list of lists containing gene names for the 
-# unsplit clusters
-# Returns a list of sets where each set is a group of paralog clusters
-def map_unsplit_to_split(inverted_index, unsplit_clusters):
-    paralogs = list()
-    
-    for cluster in unsplit_clusters:
-        para_group = set()
-        for gene in cluster:
-            para_group.add(inverted_index[gene])
-        paralogs.append(para_group)
-    return paralogs
-
-
-# Input is a list of sets of paralogs, and the list of all split clusters
+# This streams the gene_presence_absence.csv file and gives every gene
+# (prokka something) an integer id in the order it is found
+# Returns the cluster names, the strain names, a uint8 cluster x strain
+# presence matrix, a GeneTable of the gene ids and an int32 array mapping
+# each gene id to the row of its cluster
+def intern_genes(folder):
+    rows = rr.iter_rows(folder + "/gene_presence_absence.csv")
+    header = next(rows)
+    num_meta_cols = rr.get_num_meta_cols(header)
+    strain_names = header[num_meta_cols:]
+
+    cluster_names = list()
+    presence = bytearray()
+    gene_blob = bytearray()
+    genes_per_cluster = array('i')
+    for row in rows:
+        cluster_names.append(row[0])
+        cells = row[num_meta_cols:]
+        presence.extend(1 if len(x) > 0 else 0 for x in cells)
+        genes = ' '.join(cells).split()
+        if len(genes) > 0:
+            gene_blob.extend(encode_names(genes))
+        genes_per_cluster.append(len(genes))
+
+    presence = np.frombuffer(presence, dtype=np.uint8)
+    presence = presence.reshape((len(cluster_names), len(strain_names)))
+    gene_table = GeneTable(names_array(gene_blob))
+    del gene_blob
+    gene_cluster = np.repeat(np.arange(len(cluster_names), dtype=np.int32),
+                             np.array(genes_per_cluster, dtype=np.int64))
+    return cluster_names, strain_names, presence, gene_table, gene_cluster
+
+
+class ParalogGroups(object):
+    """
+    The split clusters in each unsplit (paralog) group in CSR form.  The
+    clusters of group g are clusters[ptr[g]:ptr[g + 1]], sorted by their row
+    in gene_presence_absence.csv, and cluster_group maps a row to its group.
+    """
+
+    def __init__(self, ptr, clusters, num_clusters):
+        self.ptr = ptr
+        self.clusters = clusters
+        self.sizes = np.diff(ptr)
+        self.cluster_group = np.empty(num_clusters, dtype=np.int32)
+        self.cluster_group[clusters] = np.repeat(
+            np.arange(len(self.sizes), dtype=np.int32), self.sizes)
+
+    @property
+    def num_groups(self):
+        return len(self.sizes)
+
+    def members(self, group):
+        return self.clusters[self.ptr[group]:self.ptr[group + 1]]
+
+    def ordered_groups(self):
+        """
+        :return: the groups sorted by their first cluster's row
+        """
+        return np.argsort(self.clusters[self.ptr[:-1]], kind='mergesort')
+
+
+# Inputs: a roary folder, the GeneTable and gene to cluster array from
+# intern_genes and the number of split clusters
+# Reads the _inflated_unsplit_mcl_groups file, one paralog group per line,
+# and maps each group's genes to the split clusters they were assigned to
+# Returns a ParalogGroups
+def read_paralog_groups(folder, gene_table, gene_cluster, num_clusters):
+    gene_blob = bytearray()
+    genes_per_group = array('i')
+    with open(folder + "/_inflated_unsplit_mcl_groups", 'r') as f:
+        for line in f:
+            genes = line.split()
+            if len(genes) == 0:
+                continue
+            gene_blob.extend(encode_names(genes))
+            genes_per_group.append(len(genes))
+    num_groups = len(genes_per_group)
+    group_genes = gene_table.lookup(names_array(gene_blob))
+    del gene_blob
+    gene_group = np.repeat(np.arange(num_groups, dtype=np.int64),
+                           np.array(genes_per_group, dtype=np.int64))
+
+    # One key per distinct (group, cluster) pair, sorted by group then cluster
+    keys = gene_group * num_clusters + gene_cluster[group_genes]
+    keys = np.unique(keys)
+    sizes = np.bincount(keys // num_clusters, minlength=num_groups)
+    ptr = np.concatenate(([0], np.cumsum(sizes)))
+    clusters = (keys % num_clusters).astype(np.int32)
+    return ParalogGroups(ptr, clusters, num_clusters)
+
+
+# Input is a ParalogGroups and the number of split clusters
 # Assert fails if a cluster is in multiple paralog groups or if a cluster
 # is missing
-def check_paralogs_unique(paralogs, cluster_names):
-    num_clusters = sum(len(x) for x in paralogs)
-    joined_paralogs = set().union(*paralogs)
-    assert(len(joined_paralogs) == num_clusters)
-    assert(len(cluster_names) == num_clusters)
-
-
-# Input is a list of sets of paralogs
-# Outputs a list of lists where each list represents one split cluster
-# The list has the number of clusters (including self) in the paralog group
-# The second entry is a tab separated list of those clusters
-def make_output_data(paralogs):
-    out_data = dict()
-    for clusters in paralogs:
-        num_clusters = str(len(clusters))
-        c_list = '\t'.join(clusters)
-        for cluster in clusters:
-            out_data[cluster] = [num_clusters, c_list]
-    return out_data
+def check_paralogs_unique(paralogs, num_clusters):
+    counts = np.bincount(paralogs.clusters, minlength=num_clusters)
+    assert(len(counts) == num_clusters)
+    assert(np.all(counts == 1))
+
+
+# Inputs are the cluster names, a ParalogGroups and a cluster's row
+# Returns the number of clusters (including self) in the cluster's paralog
+# group and a tab separated list of those clusters
+def get_paralog_annotation(cluster_names, paralogs, cluster):
+    group = paralogs.cluster_group[cluster]
+    names = [cluster_names[x] for x in paralogs.members(group)]
+    return [str(len(names)), '\t'.join(names)]
 
 
 # Input is a list of rows which are paralogs of each other
@@ -108,87 +204,139 @@ def make_output_data(paralogs):
 def merge_rows(paralog_rows):
     if len(paralog_rows) == 1:
         return paralog_rows[0]
-    
-    new_row = list()
-    
-    # This iterates over columns in the untransposed array
-    for column in np.array(paralog_rows).T:
-        new_entry = '\t'.join(x for x in column if len(x) > 0)
-        new_row.append(new_entry)
-    return new_row
-
-
-# Inputs are a list of lists with all the input roary data and a 
-# list of sets of paralogs
-# Output is a list of lists of roary style data in which paralog
-# groups have been combined.  These rows are sorted according to the 
-# original file
-def merge_paralogs(all_data, paralogs):
-    row_num = dict()
-    for index, row in enumerate(all_data[1:], start=1):
-        row_num[row[0]] = index
-    
-    merged_output = []  
-    
-    for clusters in paralogs:
-        paralog_rows = list()
-        first_index = maxint
-        for cluster in clusters:
-            index = row_num[cluster]
-            first_index = min(first_index, index)
-            paralog_rows.append(all_data[index])
-        merged_output.append([first_index, merge_rows(paralog_rows)])
-    
-    # Sorts, removes sort index, adds heading
-    merged_output.sort(key=lambda x: x[0])
-    merged_output = [z[1] for z in merged_output]
-    merged_output.insert(0, all_data[0])
-
-    return merged_output
 
-
-# Input: prefix - path + nickname
-# file_name - suffix w/o extension, data is a list of lists
-# Write data to a file with each entry being double quoted and commas and 
-# newlines separating entries
-def write_output(prefix, file_name, data):
-    output_str = '\n'.join('"' + ('","'.join(x)) + '"' for x in data)
-    with open(prefix + file_name + ".csv", 'w') as f:
-        f.write(output_str)
+    return ['\t'.join(x for x in column if len(x) > 0)
+            for column in zip(*paralog_rows)]
+
+
+# Inputs are the split cluster x strain presence matrix and a ParalogGroups
+# Returns the presence matrix after merging paralogs, a strain has a merged
+# cluster if it has any of the group's clusters.  Rows are in the same order
+# as the merged table.
+def merge_presence(presence, paralogs):
+    merged = np.logical_or.reduceat(presence[paralogs.clusters],
+                                    paralogs.ptr[:-1], axis=0)
+    return merged[paralogs.ordered_groups()]
+
+
+# Inputs are the split cluster names and a ParalogGroups
+# Returns the merged cluster names (group members joined by separator) in the
+# same order as the merged table
+def merge_cluster_names(cluster_names, paralogs, separator='\t'):
+    return [separator.join(cluster_names[x] for x in paralogs.members(group))
+            for group in paralogs.ordered_groups()]
+
+
+class ParalogMerger(object):
+    """
+    Collects the rows of each paralog group as gene_presence_absence.csv is
+    streamed and releases the merged rows in the order of each group's first
+    cluster.  Only groups that are incomplete or waiting on an earlier group
+    are held in memory.
+    """
+
+    def __init__(self, paralogs):
+        self.paralogs = paralogs
+        self.order = paralogs.ordered_groups()
+        self.next_group = 0
+        self.pending = dict()
+
+    # Inputs are a cluster's row number and its row, in file order
+    # Returns a list of the merged rows that are ready to be written
+    def add(self, cluster, row):
+        group = self.paralogs.cluster_group[cluster]
+        self.pending.setdefault(group, []).append(row)
+
+        ready = list()
+        while self.next_group < len(self.order):
+            group = self.order[self.next_group]
+            rows = self.pending.get(group)
+            if rows is None or len(rows) < self.paralogs.sizes[group]:
+                break
+            ready.append(merge_rows(rows))
+            del self.pending[group]
+            self.next_group += 1
+        return ready
+
+
+class RowWriter(object):
+    """
+    Writes rows to a file one at a time in roary's csv layout (see
+    rr.format_row).  Rows are separated by newlines with no newline at the
+    end of the file.
+    """
+
+    def __init__(self, file_name):
+        self.file = open(file_name, 'w')
+        self.num_rows = 0
+
+    def write(self, row):
+        if self.num_rows > 0:
+            self.file.write('\n')
+        self.file.write(rr.format_row(row))
+        self.num_rows += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Inputs are the path of a finished output file and the path of its copy
+# The copy is a hardlink when possible and a file copy otherwise.  Nothing is
+# done when they are already the same file (ex the output folder is the roary
+# folder).
+def link_or_copy(src, dst):
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
 
 
 # Inputs:
-# out_data list of lists with the number of clusters (including self) 
-# in the paralog group and a tab separated list of those clusters
+# cluster_names - the split cluster names
+# paralogs - a ParalogGroups
 # in_folder - roary output
-# paralogs - list of sets of paralogs
 # out_folder - output location
 # nickname - prefix for output files
-def make_output(out_data, in_folder, paralogs, out_folder, nickname):
-
-    cluster_names, split_clusters, all_data = get_pres_abs_data(in_folder)
-    
-    ordered_out_data = [['num_paralogs', 'paralog_group']]
-    for name in cluster_names:
-        ordered_out_data.append(out_data[name])
-    ordered_out_data = np.vstack(ordered_out_data)
-    
+# Streams gene_presence_absence.csv once, writing the annotated table, the
+# paralog table and the merged table as rows are read.
+# The merged table is linked (or copied) into the roary folder.
+def make_output(cluster_names, paralogs, in_folder, out_folder, nickname):
     prefix = out_folder + '/' + nickname + '_'
-    
-    combined_output = np.hstack((all_data[:, :2], ordered_out_data,
-                                 all_data[:, 2:]))
-    write_output(prefix, "gene_presence_absence_paralogs_annotated",
-                 combined_output)
-
-    paralog_translation = np.hstack((all_data[:, :2], ordered_out_data))
-    write_output(prefix, "paralog_table", paralog_translation)
-        
-    collapsed_paralogs = merge_paralogs(all_data, paralogs)
-    write_output(prefix, "gene_presence_absence_paralogs_merged",
-                 collapsed_paralogs)
-    write_output(in_folder, "/gene_presence_absence_paralogs_merged",
-                 collapsed_paralogs)
-    return collapsed_paralogs
+    merged_file = prefix + "gene_presence_absence_paralogs_merged.csv"
+
+    rows = rr.iter_rows(in_folder + "/gene_presence_absence.csv")
+    header = next(rows)
+    merger = ParalogMerger(paralogs)
+
+    with RowWriter(prefix + "gene_presence_absence_paralogs_annotated.csv") \
+            as annotated, \
+            RowWriter(prefix + "paralog_table.csv") as paralog_table, \
+            RowWriter(merged_file) as merged:
+        note = ['num_paralogs', 'paralog_group']
+        annotated.write(header[:2] + note + header[2:])
+        paralog_table.write(header[:2] + note)
+        merged.write(header)
+
+        for index, row in enumerate(rows):
+            note = get_paralog_annotation(cluster_names, paralogs, index)
+            annotated.write(row[:2] + note + row[2:])
+            paralog_table.write(row[:2] + note)
+
+            for merged_row in merger.add(index, row):
+                merged.write(merged_row)
+
+    link_or_copy(merged_file,
+                 in_folder + "/gene_presence_absence_paralogs_merged.csv")
 
 
 # Input: a float
@@ -197,85 +345,153 @@ def percent(decimal):
     return str(int(decimal * 100)) + "%"
 
 
+# Cluster types from the rarest to the most common.  The cutoffs between them
+# are fractions of the strains, by default those used by roary.
+CLUSTER_TYPES = ["Cloud", "Shell", "Soft core", "Core"]
+DEFAULT_CUTOFFS = [0.15, 0.95, 0.99]
+
+
 # Inputs:
-# gene_counts - a list of the number of strains that have a copy of a cluster
-# (lo, hi, name) - cutoff fractions and the name of the cluster type
+# cluster_counts - array of the number of strains that have each cluster
 # total_strains - an int
-# Returns a string describing the number of clusters found in some fraction
-# of strains.  Ex "Core genes (99% <= strains < 100%):	137"
-def get_num_clusters(gene_counts, (lo, hi, name), total_strains):
-    num = sum(1 for x in gene_counts
-               if x >= lo * total_strains and x < hi * total_strains)
-    txt = ''.join([name, " genes (", percent(lo), " <= strains < ",
-                   percent(hi), "):\t", str(num)])
-    return txt
-
-
-# Inputs:  a list of list with the gene +- matrix (including headings) with the
-# paralogs collapsed, roary input folder
-# Writes summary statistics to the roary folder
-def make_summary_stats(collapsed_paralogs, in_folder, out_folder):
-    gene_data = collapsed_paralogs[1:, 11:]
-    total_strains = len(collapsed_paralogs[1, 11:])
-
-    has_gene = np.vectorize(lambda x: len(x) > 0, otypes=[bool])
-    gene_presence = has_gene(gene_data)
-    cluster_counts = gene_presence.sum(axis=1)
-
-    cutoffs = [(0.99, 1.01, "Core"), [0.95, 0.99, "Soft core"],
-               [0.15, 0.95, "Shell"], [0.0, 0.15, "Cloud"]]
-
-    output = [get_num_clusters(cluster_counts, cutoff, total_strains)
-              for cutoff in cutoffs]
-    output.append("Total genes:\t" + str(len(gene_data) - 1))
+# cutoffs - the sorted fractions separating the cluster types
+# Returns the fraction ranges and the number of clusters of each type, where
+# a cluster is counted if lo * total_strains <= count < hi * total_strains
+def classify_clusters(cluster_counts, total_strains, cutoffs):
+    fractions = [0.0] + list(cutoffs) + [1.01]
+    edges = np.array(fractions) * total_strains
+    cluster_type = np.searchsorted(edges, cluster_counts, side='right') - 1
+    num_clusters = np.bincount(cluster_type, minlength=len(edges))
+    ranges = list(zip(fractions[:-1], fractions[1:]))
+    return ranges, num_clusters[:len(ranges)]
+
+
+# Inputs:  the merged cluster x strain presence matrix, roary input folder,
+# the output folder and the cutoffs between cluster types
+# Writes summary statistics to the output folder and the roary folder
+def make_summary_stats(merged_presence, in_folder, out_folder,
+                       cutoffs=DEFAULT_CUTOFFS):
+    cluster_counts = np.sum(merged_presence, axis=1)
+    ranges, num_clusters = classify_clusters(cluster_counts,
+                                             merged_presence.shape[1], cutoffs)
+
+    output = list()
+    for name, (lo, hi), num in reversed(list(zip(CLUSTER_TYPES, ranges,
+                                                 num_clusters))):
+        output.append(''.join([name, " genes (", percent(lo), " <= strains < ",
+                               percent(hi), "):\t", str(num)]))
+    output.append("Total genes:\t" + str(len(cluster_counts)))
     output = '\n'.join(output).replace("< 101", "<= 100")
                   
-    with open(in_folder + "/summary_statistics_paralogs_merged.csv", 'w') as f:
+    out_file = out_folder + "/summary_statistics_paralogs_merged.csv"
+    with open(out_file, 'w') as f:
         f.write(output)
+    link_or_copy(out_file, in_folder + "/summary_statistics_paralogs_merged.csv")
 
-    with open(out_folder + "/summary_statistics_paralogs_merged.csv", 'w') as f:
-        f.write(output)
 
+# Number of rows of the presence matrix formatted at a time
+RTAB_CHUNK = 4096
 
-# Makes gene_presence_absence.Rtab but after unsplitting paralogs
-# Inputs:  a list of list with the gene +- matrix (including headings) with the
-# paralogs collapsed
-# Writes summary statistics to the roary folder
-def make_gpa_rtab(collapsed_paralogs, in_folder):
-    strain_headings = collapsed_paralogs[0, 11:]
-    gene_data = collapsed_paralogs[1:, 11:]
-    gene_names = np.char.replace(collapsed_paralogs[1:, 0], '\t', ',')
 
-    has_gene = np.vectorize(lambda x: str(int(len(x) > 0)), otypes=[str])
-    pres_abs = has_gene(gene_data)
+# Input is a uint8 array of ascii characters
+# Returns them as a native str: bytes under python 2, so joining them with
+# cluster names that aren't ascii doesn't decode the names
+def ascii_str(chars):
+    text = chars.tobytes()
+    if sys.version_info[0] >= 3:
+        text = text.decode('ascii')
+    return text
+
 
+# Makes gene_presence_absence.Rtab but after unsplitting paralogs
+# Inputs:  the merged cluster x strain presence matrix, the merged cluster
+# names, the strain names and the roary input folder
+# Each chunk of rows is formatted as one byte array of 0/1 digits and tabs
+def make_gpa_rtab(merged_presence, merged_names, strain_names, in_folder):
+    num_strains = merged_presence.shape[1]
     with open(in_folder + '/gene_presence_absence_paralogs_merged.Rtab', 'w') as f:
         f.write('Gene_name\t')
-        f.write('\t'.join(strain_headings))
-        f.write('\n')
-        f.write('\n'.join('\t'.join(x) for x in
-                          np.column_stack((gene_names, pres_abs))))
-
-
-def main():
-    in_folder = argv[1]
-    out_folder = argv[2]
-    nickname = argv[3]
+        f.write('\t'.join(strain_names))
+        for start in range(0, len(merged_names), RTAB_CHUNK):
+            chunk = merged_presence[start:start + RTAB_CHUNK]
+            cells = np.full((len(chunk), 2 * num_strains - 1), ord('\t'),
+                            dtype=np.uint8)
+            cells[:, ::2] = chunk.astype(np.uint8) + ord('0')
+            for name, line in zip(merged_names[start:start + RTAB_CHUNK],
+                                  cells):
+                f.write('\n' + name + '\t' + ascii_str(line))
+
+
+# Input is an argparse parser
+# Adds the options for everything but the roary folder, shared with
+# roary_analysis.py
+def add_arguments(parser):
+    parser.add_argument('out_folder', help='folder for the output files')
+    parser.add_argument('nickname', help='prefix for the output files')
+    parser.add_argument('--cutoffs', default=','.join(map(str, DEFAULT_CUTOFFS)),
+                        help='comma separated fractions of strains between '
+                             'cloud, shell, soft core and core clusters in '
+                             'the summary statistics')
+
+
+def get_options():
+    parser = argparse.ArgumentParser(
+        description='Merges the paralogs split by roary')
+    parser.add_argument('in_folder', help='roary output folder made with '
+                                          '--dont_delete_files')
+    add_arguments(parser)
+    return parser.parse_args()
+
+
+# Inputs are the roary folder and the add_arguments options
+# Writes the paralog tables and the merged gene presence files
+def merge_paralogs(in_folder, options):
+    out_folder = options.out_folder
+    nickname = options.nickname
+    cutoffs = sorted(float(x) for x in options.cutoffs.split(','))
+    assert(len(cutoffs) == len(CLUSTER_TYPES) - 1)
     
-    cluster_names, split_clusters, unsplit_clusters = get_data(in_folder)
-    gene_name_to_cluster_dict = make_split_index(cluster_names, split_clusters)
-    paralogs = map_unsplit_to_split(gene_name_to_cluster_dict, unsplit_clusters)
+    cluster_names, strain_names, presence, gene_table, gene_cluster = \
+        intern_genes(in_folder)
+    paralogs = read_paralog_groups(in_folder, gene_table, gene_cluster,
+                                   len(cluster_names))
+    del gene_table
     
-    check_paralogs_unique(paralogs, cluster_names)
-    
-    cluster_to_paralog_counts = make_output_data(paralogs)
+    check_paralogs_unique(paralogs, len(cluster_names))
+
+    make_output(cluster_names, paralogs, in_folder, out_folder, nickname)
+
+    merged_presence = merge_presence(presence, paralogs)
+    merged_names = merge_cluster_names(cluster_names, paralogs, ',')
+    make_gpa_rtab(merged_presence, merged_names, strain_names, in_folder)
+    make_summary_stats(merged_presence, in_folder, out_folder, cutoffs)
+
+
+def tests1():
+    # Annotations with commas and quotes are written back the way roary
+    # quotes them, so the merged file reads back with the same columns
+    header = rr.META_COLUMNS['3.2.5'] + ['strain_a', 'strain_b']
+    row = ['group_1', '', 'hypothetical, protein "x"', '2', '2', '1', '1',
+           '1', '', '', '', 'a_00001', 'b_00001\tb_00002']
+    folder = tempfile.mkdtemp()
+    try:
+        file_name = folder + '/gene_presence_absence.csv'
+        with RowWriter(file_name) as writer:
+            writer.write(header)
+            writer.write(row)
+        assert(list(rr.iter_rows(file_name)) == [header, row])
+        gpa = rr.parse_gene_pres_abs(file_name)
+        assert(gpa.strain_names == ['strain_a', 'strain_b'])
+        assert(gpa.copy_num.tolist() == [[1, 2]])
+    finally:
+        shutil.rmtree(folder)
+    print('tests pass')
 
-    collapsed_paralogs = np.array(make_output(cluster_to_paralog_counts,
-                                              in_folder, paralogs, out_folder,
-                                              nickname))
 
-    make_gpa_rtab(collapsed_paralogs, in_folder)
-    make_summary_stats(collapsed_paralogs, in_folder, out_folder)
+def main():
+    options = get_options()
+    tests1()
+    merge_paralogs(options.in_folder, options)
     
     
 if __name__ == "__main__":
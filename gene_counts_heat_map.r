@@ -55,11 +55,29 @@ FilterCoreGenes <- function(df) {
   return(filtered)
 }
 
+# Metadata column names (as read.csv makes them) used by any roary version,
+# see META_COLUMNS in roary_reader.py.  3.5.1 added the group size columns.
+kMetaColumns <- c("Non.unique.Gene.name", "Annotation", "No..isolates",
+                  "No..sequences", "Avg.sequences.per.isolate",
+                  "Genome.Fragment", "Order.within.Fragment",
+                  "Accessory.Fragment", "Accessory.Order.with.Fragment", "QC",
+                  "Min.group.size.nuc", "Max.group.size.nuc",
+                  "Avg.group.size.nuc")
+
+# Input is the data from the roary output directory, with the gene names as
+# row names
+# Returns the number of metadata columns, the strains are the columns after
+# these.  This depends on the roary version that made the file.
+GetNumMetaCols <- function(gene.data.full){
+  return(max(which(colnames(gene.data.full) %in% kMetaColumns)))
+}
+
 # Input is the data from the roary output directory
 # Returns a data frame whose cols are strains, rows are genes and entries are
 # the copy number
 GetGeneDataCopies <- function(gene.data.full){
-  gene.data.poss <- gene.data.full[, 11:ncol(gene.data.full)]
+  first.strain <- GetNumMetaCols(gene.data.full) + 1
+  gene.data.poss <- gene.data.full[, first.strain:ncol(gene.data.full)]
   gene.data.copies <- as.data.frame(lapply(gene.data.poss,
                                            FUN=function(x)
                                            {sapply(x, FUN=GetCopyNumber)}))
@@ -82,7 +100,8 @@ MakeHeatMaps <- function(gene.counts, prefix){
 MakeGeneDupsTable <- function(gene.data.copies, gene.data.full, out.file){
   has.dup <- which(rowSums(gene.data.copies > 1) > 0)
   dups <- gene.data.copies[has.dup, ]
-  full.dups <- cbind(gene.data.full[has.dup, 1:10], dups)
+  meta.cols <- 1:GetNumMetaCols(gene.data.full)
+  full.dups <- cbind(gene.data.full[has.dup, meta.cols], dups)
   write.csv(file=out.file, x = full.dups)
 }
 
@@ -92,7 +111,8 @@ MakeGeneDupsTable <- function(gene.data.copies, gene.data.full, out.file){
 MakeGeneCountsTable <- function(gene.data.copies, gene.data.full, out.file){
   has.dup <- which(rowSums(gene.data.copies > 1) > 0)
   dups <- gene.data.copies[has.dup, ]
-  full.dups <- cbind(gene.data.full[, 1:10], gene.data.copies)
+  meta.cols <- 1:GetNumMetaCols(gene.data.full)
+  full.dups <- cbind(gene.data.full[, meta.cols], gene.data.copies)
   write.csv(file=out.file, x = full.dups)
 }
 
@@ -3,12 +3,15 @@
 # to standard out the input for cgs_supragenome.m which can be found at
 # https://github.com/rehrlich/fsgm
 
+import argparse
 import os
 import sys
 sys.path.append(os.getcwd())
 import pairwise_table as pt
-import numpy as np
 from collections import Counter
+from lazy_import import LazyModule
+
+np = LazyModule('numpy')
 
 # Input is a gene possession matrix as a numpy matrix
 # Ouput is a dictionary, keys = number of strain, values = number of genes found
@@ -25,9 +28,15 @@ def print_c_for_fsgm(gene_counts_dict, num_strains):
         ordered_gene_counts.append(gene_counts_dict[i])
     sys.stdout.write(' '.join(map(str, ordered_gene_counts)))
                    
+def get_options():
+    parser = argparse.ArgumentParser(
+        description='Write the gene counts cgs_supragenome.m takes as input')
+    parser.add_argument('roary_output', help='folder with the roary output')
+    return parser.parse_args()
+
 def main():
-    folder = sys.argv[1]
-    poss_mat, cols = pt.get_pres_abs_mat(folder)
+    options = get_options()
+    poss_mat, cols = pt.get_pres_abs_mat(options.roary_output)
     gene_counts_dict = get_gene_counts_dict(poss_mat)
     print_c_for_fsgm(gene_counts_dict, len(cols))
     
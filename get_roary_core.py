@@ -5,8 +5,8 @@ This program takes the path to a roary output directory and creates csv files
 with lists of core genes.  In one list, the paralogs have been split, in the
 other, the split paralogs have been merged.
 """
-import sys
-import pandas as pd
+import argparse
+import roary_reader as rr
 
 
 def split_core(roary_out):
@@ -32,22 +32,17 @@ def merged_core(roary_out):
     :param roary_out: path to roary output
     :return: list of core genes when paralogs have been merged
     """
-    merged_data = pd.read_csv(roary_out + '/gene_presence_absence_paralogs_merged.csv',
-                              index_col=0)
+    merged = rr.read_gene_pres_abs(roary_out +
+                                   '/gene_presence_absence_paralogs_merged.csv')
+    is_core = merged.presence.all(axis=1)
+    return [name for name, core in zip(merged.cluster_names, is_core) if core]
 
-    data_headers = 'Non-unique Gene name","Annotation","No. isolates","No. sequences","Avg sequences per isolate","Genome Fragment","Order within Fragment","Accessory Fragment","Accessory Order with Fragment","QC'
-    data_headers = data_headers.split('","')
-
-    for col in data_headers:
-        del merged_data[col]
-
-    merged_data.dropna(inplace=True)
-    return merged_data.index
-
-
-def main():
-    roary_out = sys.argv[1]
 
+def write_core_lists(roary_out):
+    """
+    Writes the split and merged core gene lists to the roary folder
+    :param roary_out: path to roary output, after find_paralogs.py
+    """
     core_genes = split_core(roary_out)
     with open(roary_out + '/core_genes_list.txt', 'w') as f:
         f.write(','.join(core_genes))
@@ -56,6 +51,20 @@ def main():
     with open(roary_out + '/core_genes_list_merged.txt', 'w') as f:
         f.write(','.join(core_genes))
 
+
+def get_options():
+    parser = argparse.ArgumentParser(
+        description='Write the split and merged core gene lists of a roary run')
+    parser.add_argument('roary_out',
+                        help='folder with the roary output, after '
+                             'find_paralogs.py')
+    return parser.parse_args()
+
+
+def main():
+    options = get_options()
+    write_core_lists(options.roary_out)
+
 if __name__ == "__main__":
     main()
 
@@ -0,0 +1,56 @@
+"""
+Deferred imports for the command line scripts
+numpy, matplotlib, seaborn, pandas and Biopython take longer to import than
+many of the scripts take to run, and a script that is only asked for --help or
+given bad arguments never uses them.  A LazyModule stands in for a module and
+imports it the first time one of its attributes is used:
+    np = LazyModule('numpy')
+    plt = LazyModule('matplotlib.pyplot')
+Each attribute is looked up once and then kept on the LazyModule, so code in
+loops pays for a normal attribute lookup.
+"""
+import importlib
+
+
+class LazyModule(object):
+    """
+    Stand in for the module named name, imported on first use
+    """
+
+    def __init__(self, name):
+        self.__dict__['_lazy_name'] = name
+        self.__dict__['_lazy_module'] = None
+
+    # Names of the proxy's own methods start with _lazy so they can't hide
+    # an attribute of the module (ex numpy.load)
+    def _lazy_load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_lazy_name'])
+            self.__dict__['_lazy_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        # Only called for attributes not already kept in __dict__
+        value = getattr(self._lazy_load(), attr)
+        self.__dict__[attr] = value
+        return value
+
+    def __setattr__(self, attr, value):
+        setattr(self._lazy_load(), attr, value)
+        self.__dict__[attr] = value
+
+    def __dir__(self):
+        return dir(self._lazy_load())
+
+    def __repr__(self):
+        state = 'loaded' if is_loaded(self) else 'not loaded'
+        return '<lazy module %r (%s)>' % (self.__dict__['_lazy_name'], state)
+
+
+# Input is a LazyModule or a module
+# Returns True if the module has been imported
+def is_loaded(module):
+    if isinstance(module, LazyModule):
+        return module.__dict__['_lazy_module'] is not None
+    return True
@@ -1,26 +1,66 @@
 #!/usr/bin/env python3
 """
 Plots of the pairwise tables make it easy to spot outliers.  This is an attempt
-to use statistics to show that certain strains should be removed.
+to use statistics to show that certain strains should be removed.  A strain is
+an outlier when its median score is more than --num-mads median absolute
+deviations (of all the scores) below or above the median of all the scores.
 python3 pairwise_outliers.py /data/shared/homes/rachel/COPD/75_figures
+With --npz, the tables are read from the nickname_pairwise.npz file written by
+pairwise_table.py --npz instead of its text tables.  from_strain_pairs turns
+pairwise_table.compare_all_strain_pairs output into comparisons directly.
 """
 
-import sys
+import argparse
 from glob import iglob
-import pandas as pd
-import matplotlib.pyplot as plt
-import numpy as np
-from collections import defaultdict, deque
-from statistics import median
+from collections import deque
+import pairwise_table as pt
+from lazy_import import LazyModule
+
+pd = LazyModule('pandas')
+plt = LazyModule('matplotlib.pyplot')
+np = LazyModule('numpy')
 
 
 class PairWiseComparison:
-    def __init__(self, file_path):
-        self.file_path = file_path
-        self.pair_type, self.pair_counts = self.parse_file()
-        self.stacked = self.pair_counts.stack(0)
+    def __init__(self, pair_type, strains, full):
+        """
+        :param pair_type: the type of table (similarity, difference,
+        pair_unique)
+        :param strains: list of the strain names
+        :param full: symmetric strain x strain float matrix of the scores,
+        NaN where there is no score (the diagonal)
+        """
+        self.pair_type = pair_type
+        self.strains = strains
+        self.full = full
+        self.scores = self.get_scores()
         self.median_val, self.mad = self.calc_stats()
 
+    @classmethod
+    def from_table(cls, file_path):
+        """
+        :param file_path: an upper triangular table from pairwise_table.py
+        :return: a PairWiseComparison of the table
+        """
+        pair_type = file_path.split('pairwise_')[1].split('_table')[0]
+        pair_counts = pd.read_table(file_path, index_col=0)
+        strains, full = symmetric_matrix(pair_counts)
+        return cls(pair_type, strains, full)
+
+    @classmethod
+    def from_matrix(cls, pair_type, strains, counts):
+        """
+        :param pair_type: the type of table
+        :param strains: list of the strain names
+        :param counts: strain x strain matrix, only the entries above the
+        diagonal are used
+        :return: a PairWiseComparison of the matrix
+        """
+        upper = np.triu(np.ones(counts.shape, dtype=bool), 1)
+        full = np.where(upper, counts, np.nan)
+        full = np.where(upper.T, full.T, full)
+        return cls(pair_type, strains, full)
+
     def plot_counts(self, out_file):
         """
         Writes a histogram of all the data in self.pair_counts to out_file
@@ -29,69 +69,175 @@ class PairWiseComparison:
         """
         fig, ax = plt.subplots()
         title = "median is " + str(self.median_val) + " mad is " + str(self.mad)
-        self.stacked.hist(ax=ax, bins=50)
+        ax.hist(self.scores, bins=50)
         fig.suptitle(title)
         fig.savefig(out_file)
 
-    def parse_file(self):
+    def get_scores(self):
         """
-        :return: the type (sim, diff, pair unique) and the upper triangular matrix
+        :return: array of all the scores in the table, each pair once
         """
-        pair_type = self.file_path.split('pairwise_')[1].split('_table')[0]
-        pair_counts = pd.read_table(self.file_path, index_col=0)
-        return pair_type, pair_counts
+        values = self.full[np.triu(np.ones(self.full.shape, dtype=bool), 1)]
+        return values[~np.isnan(values)]
 
     def calc_stats(self):
-        median_val = self.stacked.median()
-        mad = abs(self.stacked - median_val).median()
+        median_val = np.median(self.scores)
+        mad = np.median(np.abs(self.scores - median_val))
         return median_val, mad
 
-    def find_outliers(self):
+    def strain_medians(self):
         """
-        gets all scores associated with a strain.  Since the df is upper
-        triangular, each score gets assigned to both the associated strains.
-        returns a list of strains with low or high medians
-        :return:
+        :return: array of the median of each strain's scores
         """
-        cluster_counts = defaultdict(list)
-
-        for strain, counts in self.pair_counts.iteritems():
-            cluster_counts[strain].extend([x for x in counts if not np.isnan(x)])
-
-        for strain, counts in self.pair_counts.iterrows():
-            cluster_counts[strain].extend([x for x in counts if not np.isnan(x)])
+        return np.nanmedian(self.full, axis=1)
 
-        thresh = self.mad * 2
-        results = list()
+    def find_outliers(self, num_mads=2.0):
+        """
+        Finds the strains whose median score is more than num_mads * mad away
+        from the median of all the scores.  The mad is that of all the scores,
+        one scale for every strain, so a strain whose own scores don't vary
+        but are far from the rest is still found.  If the mad is 0 every
+        strain whose median differs from the median of all the scores is an
+        outlier.
+        :param num_mads: the threshold, in median absolute deviations of all
+        the scores
+        :return: the header and a list of lines for the strains with low or
+        high medians, sorted by strain name
+        """
+        strains = self.strains
+        medians = self.strain_medians()
+        thresh = self.mad * num_mads
         header = '\t'.join(['strain', 'comparison_type', 'direction',
-                           'strain_median', 'pan_genome_median'])
-        for strain, counts in cluster_counts.items():
-
-            med = median(counts)
-            if med < med + thresh < self.median_val:
-                results.append('\t'.join([strain, self.pair_type, 'low',
-                                          str(med),
-                                          str(self.median_val)]))
-
-            if med > med - thresh > self.median_val:
-                results.append('\t'.join([strain, self.pair_type, 'high',
-                                          str(med),
-                                          str(self.median_val)]))
+                            'strain_median', 'pan_genome_median'])
 
+        low = medians + thresh < self.median_val
+        high = medians - thresh > self.median_val
+        results = list()
+        for i in sorted(np.flatnonzero(low | high), key=lambda x: strains[x]):
+            direction = 'low' if low[i] else 'high'
+            results.append('\t'.join([strains[i], self.pair_type, direction,
+                                      str(medians[i]),
+                                      str(self.median_val)]))
         return header, results
 
 
-def main():
-    roary_figs = sys.argv[1]
+def symmetric_matrix(pair_counts):
+    """
+    Since the df is upper triangular, each score belongs to both of its
+    strains.  This fills in the lower triangle so each strain's scores are
+    its row.
+    :param pair_counts: an upper triangular table from pairwise_table.py
+    :return: list of strains and the strain x strain float matrix, NaN where
+    there is no score (the diagonal)
+    """
+    strains = pair_counts.columns.append(pair_counts.index).unique()
+    full = pair_counts.reindex(index=strains, columns=strains)
+    full = full.to_numpy(dtype=np.float64)
+    return list(strains), np.where(np.isnan(full), full.T, full)
+
+
+def from_strain_pairs(strain_pairs, strains):
+    """
+    :param strain_pairs: a pairwise_table.PairCounts
+    :param strains: list of the strain names
+    :return: a list of PairWiseComparisons, one for each of pairwise_table's
+    single tables
+    """
+    return [PairWiseComparison.from_matrix(table_type, strains,
+                                           strain_pairs[index])
+            for index, table_type in pt.SINGLE_TABLES]
+
+
+def read_npz(file_name):
+    """
+    :param file_name: bundle written by pairwise_table.py --npz
+    :return: a list of PairWiseComparisons, one for each table in it
+    """
+    with np.load(file_name) as bundle:
+        strains = [str(x) for x in bundle['strains']]
+        strain_pairs = pt.PairCounts(*[bundle[x]
+                                       for x in pt.PairCounts._fields])
+    return from_strain_pairs(strain_pairs, strains)
+
+
+def find_all_outliers(comparisons, out_folder, num_mads=2.0):
+    """
+    Plots each comparison's histogram to out_folder and finds its outliers
+    :param comparisons: list of PairWiseComparisons
+    :param out_folder: folder for the histograms
+    :param num_mads: the threshold, in median absolute deviations of all
+    the scores
+    :return: the lines of the outlier table, starting with its header
+    """
     output = deque()
-    for file_name in iglob(roary_figs + '/*pairwise*i*table.txt'):
-        pair_data = PairWiseComparison(file_name)
-        pair_data.plot_counts(roary_figs + '/counts_hist_' +
+    header = None
+    for pair_data in comparisons:
+        pair_data.plot_counts(out_folder + '/counts_hist_' +
                               pair_data.pair_type + '.pdf')
-        header, results = pair_data.find_outliers()
+        header, results = pair_data.find_outliers(num_mads)
         output.extend(results)
-
     output.appendleft(header)
+    return output
+
+
+# Input is a list of PairWiseComparisons
+# Returns them in the order of pairwise_table's single tables, the order
+# read_npz gives
+def sort_comparisons(comparisons):
+    order = [table_type for index, table_type in pt.SINGLE_TABLES]
+    return sorted(comparisons, key=lambda x: order.index(x.pair_type))
+
+
+def tests1():
+    # A strain far below the rest is an outlier even though its own scores
+    # don't vary
+    rs = np.random.RandomState(0)
+    counts = rs.normal(99, 1, (8, 8))
+    counts = (counts + counts.T) / 2
+    counts[2, :] = 10
+    counts[:, 2] = 10
+    strains = ['s%d' % i for i in range(8)]
+    header, results = PairWiseComparison.from_matrix(
+        'similarity', strains, counts).find_outliers(2.0)
+    assert([x.split('\t')[:3] for x in results] ==
+           [['s2', 'similarity', 'low']])
+
+    # Text tables and the .npz give the outliers in the same order
+    counts[5, :] = 200
+    counts[:, 5] = 200
+    forward = PairWiseComparison.from_matrix('similarity', strains, counts)
+    backward = PairWiseComparison.from_matrix(
+        'similarity', strains[::-1], counts[::-1, ::-1])
+    assert(forward.find_outliers()[1] == backward.find_outliers()[1])
+    print('tests pass')
+
+
+def get_options():
+    parser = argparse.ArgumentParser(
+        description='Find strains with outlying pairwise table scores')
+    parser.add_argument('roary_figs',
+                        help='folder with the pairwise_table.py output')
+    parser.add_argument('--num-mads', type=float, default=2.0,
+                        help='how many median absolute deviations (of all '
+                             'the scores) a strain median has to be from the '
+                             'median of all the scores to be an outlier')
+    parser.add_argument('--npz', default=None,
+                        help='read the tables from this pairwise_table.py '
+                             '--npz bundle instead of the text tables')
+    return parser.parse_args()
+
+
+def main():
+    options = get_options()
+    tests1()
+    roary_figs = options.roary_figs
+    if options.npz is not None:
+        comparisons = read_npz(options.npz)
+    else:
+        comparisons = sort_comparisons(
+            PairWiseComparison.from_table(x) for x in
+            iglob(roary_figs + '/*pairwise*i*table.txt'))
+    output = find_all_outliers(comparisons, roary_figs, options.num_mads)
     with open(roary_figs + '/pairwise_outliers.tsv', 'w') as f:
         f.write('\n'.join(output))
 
@@ -11,33 +11,31 @@
 # comparison = similarity - difference
 # pair unique = present in only those two stains
 
-import numpy as np
 from collections import namedtuple
-import sys
+import argparse
+import ctypes
+import json
+import multiprocessing
+import os
+import roary_reader as rr
+from lazy_import import LazyModule
+
+np = LazyModule('numpy')
 
 
 # Input is the folder with the roary output files
 # This takes the gene_presence_absence.csv file and converts it to a gene
-# presence and absence matrix
+# presence and absence matrix.  With packed the matrix is bit packed instead
+# (see rr.pack_words), and with mmap as well it is a read only view of the
+# reader's cache file, shared through the page cache by every process that
+# maps it.  The boolean matrix is unpacked from the cache into this process.
 # Returns the matrix and the strain names
-def get_pres_abs_mat(folder):
-    with open(folder + "/gene_presence_absence.csv", 'rU') as f:
-        lines_end_quotes = f.read().split('\n')
-    lines = [x[1:-1] for x in lines_end_quotes]   
-    
-    # The file is a csv but the annotations contain commas...
-    split_lines = [x.split('","') for x in lines if len(x) > 0]
-    
-    col_headings = split_lines[0][11:]
-    rows = split_lines[1:]
-    poss_data = np.zeros((len(rows), len(col_headings)), dtype=bool)
-
-    for i in xrange(len(rows)):
-        row = rows[i]
-        copy_num = row[11:]
-        poss_data[i] = np.array([len(x) > 0 for x in copy_num], dtype=bool)
-
-    return poss_data, col_headings
+def get_pres_abs_mat(folder, mmap=False, packed=False):
+    gpa = rr.read_gene_pres_abs(folder + "/gene_presence_absence.csv",
+                                mmap=mmap)
+    if packed:
+        return gpa.presence_words(), gpa.strain_names
+    return gpa.presence, gpa.strain_names
 
 
 # Input: two numpy row vectors
@@ -61,32 +59,369 @@ def get_pair_unique2(poss_mat, i, j):
     return np.sum(np.logical_and(b, c))
 
 
-# Inputs: the gene possession matrix and number of strains it contains
-# Output: the strain_pairs data structure which is a dict() whose keys are
-# tuples of strain pair index numbers and whose values are a named tuple
-# with counts for the similarity, difference, comparison and pair unique
-# for the two strains
-def compare_all_strain_pairs(poss_mat, num_strains):
-    num_genes = namedtuple('num_genes', ['sim', 'diff', 'comp', 'pair_unique'])
-    strain_pairs = dict()
-
+# Counts for every strain pair, each field is a num_strains x num_strains
+# int32 matrix and only the entries above the diagonal (i < j) are used
+PairCounts = namedtuple('PairCounts', ['sim', 'diff', 'comp', 'pair_unique'])
+
+# Number of gene rows converted to float at a time for the matrix products
+GENE_CHUNK = 8192
+# Number of 64 bit words ANDed at a time by the popcount kernel
+POPCOUNT_WORDS = 1 << 16
+
+
+# Inputs: two gene possession matrices with the same genes (rows)
+# Output: int32 matrix whose [i, j] entry is the number of genes present in
+# both column i of mat_a and column j of mat_b.  The products are done in
+# float32 chunks so BLAS can be used, counts below 2**24 are exact.
+def count_shared_genes(mat_a, mat_b):
+    shared = np.zeros((mat_a.shape[1], mat_b.shape[1]), dtype=np.int32)
+    for start in range(0, mat_a.shape[0], GENE_CHUNK):
+        a = mat_a[start:start + GENE_CHUNK].astype(np.float32)
+        b = mat_b[start:start + GENE_CHUNK].astype(np.float32)
+        shared += np.dot(a.T, b).astype(np.int32)
+    return shared
+
+
+# Inputs: two gene possession matrices bit packed along the genes with
+# rr.pack_words, so each row is a strain and each column 64 genes
+# Output: int32 matrix whose [i, j] entry is the number of genes present in
+# both row i of words_a and row j of words_b, the set bits of their AND.
+# Whole blocks of row pairs are ANDed at once, broadcasting to a
+# (rows x columns x words) array of about POPCOUNT_WORDS words.
+def count_shared_bits(words_a, words_b):
+    words_a = np.ascontiguousarray(words_a)
+    words_b = np.ascontiguousarray(words_b)
+    num_words = max(1, words_b.shape[1])
+    shared = np.empty((words_a.shape[0], words_b.shape[0]), dtype=np.int32)
+    col_chunk = max(1, min(words_b.shape[0], POPCOUNT_WORDS // num_words))
+    row_chunk = max(1, POPCOUNT_WORDS // (col_chunk * num_words))
+    for i in range(0, words_a.shape[0], row_chunk):
+        a = words_a[i:i + row_chunk, np.newaxis, :]
+        for j in range(0, words_b.shape[0], col_chunk):
+            both = np.bitwise_and(a, words_b[np.newaxis, j:j + col_chunk, :])
+            shared[i:i + row_chunk, j:j + col_chunk] = np.sum(
+                rr.popcount(both), axis=2, dtype=np.int32)
+    return shared
+
+
+# How each kernel counts the shared genes of two blocks of strains
+# blas: float32 matrix products of the (genes x strains) boolean matrix
+# popcount: ANDs of the (strains x words) bit packed matrix, which is 8x
+# smaller than the booleans and is read from the reader's cache as is
+KERNELS = {'blas': count_shared_genes, 'popcount': count_shared_bits}
+
+
+# Input is a gene possession matrix, either booleans or bit packed words
+# Returns True if it is bit packed (rr.pack_words), with a row per strain
+def is_packed(poss_mat):
+    return poss_mat.dtype == np.uint64
+
+
+# Input is a gene possession matrix, either booleans or bit packed words
+# Returns the number of strains it has
+def count_strains(poss_mat):
+    if is_packed(poss_mat):
+        return poss_mat.shape[0]
+    return poss_mat.shape[1]
+
+
+# Inputs are a gene possession matrix in the kernel's layout, a slice of
+# strains and the name of the kernel
+# Returns the part of the matrix for those strains
+def select_strains(poss_mat, strains, kernel='blas'):
+    if kernel == 'popcount':
+        return poss_mat[strains]
+    return poss_mat[:, strains]
+
+
+# Inputs: the gene possession matrix in the kernel's layout, the number of
+# genes in each strain, the rows of the gene possession matrix for genes
+# found in exactly two strains, the strains (slices) for the rows and columns
+# of the tile and the name of the kernel
+# Output: a PairCounts with the counts for every row strain vs column strain.
+# Genes found in one strain can't be shared and core genes can't differ, so
+# similarity = presence^T . presence and difference = n_i + n_j - 2 * sim
+# (the set bits of the XOR, without a second pass over the genes).
+# Pair unique is the similarity restricted to genes found in two strains.
+def compare_strain_block(poss_mat, strain_counts, pair_unique_mat, rows, cols,
+                         kernel='blas'):
+    count = KERNELS[kernel]
+    sim = count(select_strains(poss_mat, rows, kernel),
+                select_strains(poss_mat, cols, kernel))
+    diff = (strain_counts[rows, np.newaxis] +
+            strain_counts[np.newaxis, cols] - 2 * sim)
+    comp = sim - diff
+    pair_unique = count(select_strains(pair_unique_mat, rows, kernel),
+                        select_strains(pair_unique_mat, cols, kernel))
+    return PairCounts(sim, diff, comp, pair_unique)
+
+
+# Input is a (strains x words) gene possession matrix from rr.pack_words
+# Returns the number of genes in each strain and the words of the genes
+# found in exactly two strains.  The words are unpacked a chunk of genes at
+# a time, so the whole boolean matrix is never made.
+def get_word_inputs(words):
+    strain_counts = np.zeros(words.shape[0], dtype=np.int32)
+    pair_unique = [np.zeros((0, words.shape[0]), dtype=bool)]
+    for chunk in rr.iter_unpacked(words):
+        strain_counts += np.sum(chunk, axis=0, dtype=np.int32)
+        pair_unique.append(chunk[np.sum(chunk, axis=1) == 2, :])
+    return strain_counts, rr.pack_words(np.concatenate(pair_unique))
+
+
+# Inputs are the gene possession matrix, booleans or (for popcount) already
+# bit packed, and the name of the kernel
+# Returns the gene possession matrix in the kernel's layout, the number of
+# genes in each strain and the rows of the matrix for genes found in exactly
+# two strains, also in the kernel's layout
+def get_block_inputs(poss_mat, kernel='blas'):
+    if kernel == 'popcount':
+        words = poss_mat if is_packed(poss_mat) else rr.pack_words(poss_mat)
+        strain_counts, pair_unique_words = get_word_inputs(words)
+        return words, strain_counts, pair_unique_words
+    if is_packed(poss_mat):
+        raise ValueError('the %s kernel needs the boolean gene possession '
+                         'matrix' % kernel)
+    strain_counts = np.sum(poss_mat, axis=0).astype(np.int32)
     pair_unique_mat = poss_mat[np.sum(poss_mat, axis=1) == 2, :]
+    return poss_mat, strain_counts, pair_unique_mat
+
+
+# Inputs: the gene possession matrix, number of strains it contains, the
+# number of worker processes and the name of the kernel
+# Output: a PairCounts with the similarity, difference, comparison and
+# pair unique counts for all pairs of strains
+def compare_all_strain_pairs(poss_mat, num_strains, jobs=1, kernel='blas'):
+    assert(count_strains(poss_mat) == num_strains)
+    if jobs > 1:
+        return compare_all_strain_pairs_parallel(poss_mat, num_strains, jobs,
+                                                 kernel=kernel)
+    count_mat, strain_counts, pair_unique_mat = get_block_inputs(poss_mat,
+                                                                 kernel)
+    every_strain = slice(0, num_strains)
+    return compare_strain_block(count_mat, strain_counts, pair_unique_mat,
+                                every_strain, every_strain, kernel)
+
+
+# Inputs: number of strains and the number of strains per block
+# Returns a list of slices covering all the strains
+def get_blocks(num_strains, block_size):
+    return [slice(start, min(start + block_size, num_strains))
+            for start in range(0, num_strains, block_size)]
+
+
+# Input is the number of blocks
+# Returns the (row block, column block) index pairs on or above the diagonal
+def get_tiles(num_blocks):
+    return [(bi, bj) for bi in range(num_blocks) for bj in range(bi, num_blocks)]
+
+
+# Inputs are the lines of the finished tiles file after the settings and the
+# number of blocks
+# Returns the set of finished (row block, column block) tiles.  Lines that
+# aren't two block indices, like a last line torn by a crash, are skipped.
+def read_done_tiles(lines, num_blocks):
+    done = set()
+    for line in lines:
+        fields = line.split('\t')
+        if len(fields) != 2 or not all(x.isdigit() for x in fields):
+            continue
+        tile_id = (int(fields[0]), int(fields[1]))
+        if tile_id[0] <= tile_id[1] < num_blocks:
+            done.add(tile_id)
+    return done
+
+
+# Inputs: output path prefix, number of strains, the block size, the kernel
+# and the rr.get_fingerprint of the input gene_presence_absence.csv
+# Opens (or creates) one memory mapped .npy file per PairCounts field and
+# the file listing the finished tiles.  The earlier run is only resumed if it
+# used the same number of strains, block size, kernel and input file.  With
+# no fingerprint the input can't be checked, so the tiles start fresh.
+# Returns the PairCounts of memmaps, a set of finished tiles and the file of
+# finished tiles opened for appending
+def open_tiled_output(prefix, num_strains, block_size, kernel='blas',
+                      fingerprint=None):
+    npy_files = [prefix + '_pairwise_' + field + '.npy'
+                 for field in PairCounts._fields]
+    tiles_file = prefix + '_pairwise_tiles_done.txt'
+    source = json.dumps(fingerprint, sort_keys=True)
+    settings = ('num_strains\t%d\tblock_size\t%d\tkernel\t%s\tinput\t%s' %
+                (num_strains, block_size, kernel, source))
+
+    done = set()
+    resume = (fingerprint is not None and
+              all(os.path.isfile(x) for x in npy_files + [tiles_file]))
+    if resume:
+        with open(tiles_file, 'r') as f:
+            lines = f.read().split('\n')
+        resume = lines[0] == settings
+        num_blocks = len(get_blocks(num_strains, block_size))
+        done = read_done_tiles(lines[1:], num_blocks)
+
+    if resume:
+        mats = [np.lib.format.open_memmap(x, mode='r+') for x in npy_files]
+        progress = open(tiles_file, 'a')
+    else:
+        mats = [np.lib.format.open_memmap(x, mode='w+', dtype=np.int32,
+                                          shape=(num_strains, num_strains))
+                for x in npy_files]
+        progress = open(tiles_file, 'w')
+        progress.write(settings + '\n')
+        done = set()
+    return PairCounts(*mats), done, progress
+
+
+# Inputs: the PairCounts of memmaps, the tile's PairCounts, the row and
+# column slices of the tile and the file of finished tiles
+# Writes the tile to disk before recording it as finished
+def save_tile(strain_pairs, tile, rows, cols, tile_id, progress):
+    for out_mat, tile_mat in zip(strain_pairs, tile):
+        out_mat[rows, cols] = tile_mat
+        out_mat.flush()
+    progress.write('%d\t%d\n' % tile_id)
+    progress.flush()
+    os.fsync(progress.fileno())
+
+
+# Set in each worker process by init_worker.  The gene possession matrix is
+# a view of shared memory so it is not pickled for every tile.
+_worker_data = dict()
+
+
+# Input is a memory mapped array, possibly a slice of the mapped array
+# Returns the byte offset of its first element in the file.  A slice keeps
+# the offset of the array it came from, so the distance from that array's
+# first element is added.
+def get_file_offset(arr):
+    root = arr
+    while isinstance(root.base, np.memmap):
+        root = root.base
+    return root.offset + (arr.ctypes.data - root.ctypes.data)
+
+
+# Input is a numpy array
+# Returns what worker processes need to attach_array the same data without
+# a copy each.  A contiguous memory mapped array (or slice of one) is mapped
+# again from its file, anything else is copied once into shared memory that
+# the workers inherit.
+def share_array(arr):
+    if (isinstance(arr, np.memmap) and arr.filename is not None and
+            arr.flags.c_contiguous):
+        return ('memmap', arr.filename, get_file_offset(arr), arr.shape,
+                arr.dtype.str)
+    shared = multiprocessing.RawArray(ctypes.c_uint8, arr.nbytes)
+    view = np.frombuffer(shared, dtype=arr.dtype).reshape(arr.shape)
+    view[...] = arr
+    return ('shared', shared, 0, arr.shape, arr.dtype.str)
+
+
+# Input is the output of share_array
+# Returns the array it describes
+def attach_array(source):
+    kind, data, offset, shape, dtype = source
+    if kind == 'memmap':
+        return np.memmap(data, dtype=dtype, mode='r', offset=offset,
+                         shape=shape)
+    return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+
+def init_worker(source, strain_counts, pair_unique_mat, blocks, kernel):
+    _worker_data.update(poss_mat=attach_array(source),
+                        strain_counts=strain_counts,
+                        pair_unique_mat=pair_unique_mat, blocks=blocks,
+                        kernel=kernel)
+
+
+# Input is a (row block, column block) pair, run in a worker process
+# Returns the input and the tile's PairCounts
+def compare_tile(tile_id):
+    blocks = _worker_data['blocks']
+    tile = compare_strain_block(_worker_data['poss_mat'],
+                                _worker_data['strain_counts'],
+                                _worker_data['pair_unique_mat'],
+                                blocks[tile_id[0]], blocks[tile_id[1]],
+                                _worker_data['kernel'])
+    return tile_id, tile
+
+
+# Inputs: the gene possession matrix, a list of strain slices, the tiles to
+# compute, the number of processes and the name of the kernel
+# Yields each tile id with its PairCounts, in order of completion when the
+# tiles are spread over a process pool
+def iter_tiles(poss_mat, blocks, tiles, jobs=1, kernel='blas'):
+    count_mat, strain_counts, pair_unique_mat = get_block_inputs(poss_mat,
+                                                                 kernel)
+    if jobs <= 1:
+        for tile_id in tiles:
+            yield tile_id, compare_strain_block(count_mat, strain_counts,
+                                                pair_unique_mat,
+                                                blocks[tile_id[0]],
+                                                blocks[tile_id[1]], kernel)
+        return
+
+    pool = multiprocessing.Pool(jobs, initializer=init_worker,
+                                initargs=(share_array(count_mat),
+                                          strain_counts, pair_unique_mat,
+                                          blocks, kernel))
+    try:
+        for result in pool.imap_unordered(compare_tile, tiles):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+# Inputs: number of strains and number of processes
+# Returns a block size giving a few tiles per process, for load balancing
+def get_parallel_block_size(num_strains, jobs):
+    return max(1, int(np.ceil(num_strains / (2.0 * jobs))))
+
+
+# Inputs: the gene possession matrix, number of strains, number of
+# processes, the number of strains per block and the name of the kernel
+# Computes the tiles on or above the diagonal in a process pool and copies
+# them into in memory matrices
+# Output: a PairCounts of the matrices
+def compare_all_strain_pairs_parallel(poss_mat, num_strains, jobs,
+                                      block_size=None, kernel='blas'):
+    if block_size is None:
+        block_size = get_parallel_block_size(num_strains, jobs)
+    blocks = get_blocks(num_strains, block_size)
+    strain_pairs = PairCounts(*[np.zeros((num_strains, num_strains),
+                                         dtype=np.int32)
+                                for field in PairCounts._fields])
+    for tile_id, tile in iter_tiles(poss_mat, blocks,
+                                    get_tiles(len(blocks)), jobs, kernel):
+        rows, cols = blocks[tile_id[0]], blocks[tile_id[1]]
+        for out_mat, tile_mat in zip(strain_pairs, tile):
+            out_mat[rows, cols] = tile_mat
+    return strain_pairs
 
-    no_core_mat = poss_mat[np.sum(poss_mat, axis=1) != num_strains, :].T
-
-    no_unique_mat = poss_mat[np.sum(poss_mat, axis=1) != 1, :].T
-
-    # Iterate over all unique pairs of strains
-    for i in xrange(num_strains):
-        for j in xrange(i + 1, num_strains):
-            s2 = get_sim2(no_unique_mat[i, :], no_unique_mat[j, :])
-            d2 = get_diff2(no_core_mat[i, :], no_core_mat[j, :])
-
-            c = s2 - d2
-
-            p2 = get_pair_unique2(pair_unique_mat, i, j)
 
-            strain_pairs[(i, j)] = num_genes(s2, d2, c, p2)
+# Inputs: the gene possession matrix, number of strains, output path prefix,
+# the number of strains per block, the number of processes, the name of
+# the kernel and the rr.get_fingerprint of the input file
+# Computes the strain pairs one block x block tile at a time into memory
+# mapped .npy files, skipping tiles finished by an earlier run on the same
+# input.  Only the tiles on or above the diagonal are computed.
+# Output: a PairCounts of the memmaps
+def compare_all_strain_pairs_tiled(poss_mat, num_strains, prefix, block_size,
+                                   jobs=1, kernel='blas', fingerprint=None):
+    assert(count_strains(poss_mat) == num_strains)
+    blocks = get_blocks(num_strains, block_size)
+    strain_pairs, done, progress = open_tiled_output(prefix, num_strains,
+                                                     block_size, kernel,
+                                                     fingerprint)
+    tiles = [x for x in get_tiles(len(blocks)) if x not in done]
+    with progress:
+        for tile_id, tile in iter_tiles(poss_mat, blocks, tiles, jobs,
+                                        kernel):
+            rows, cols = blocks[tile_id[0]], blocks[tile_id[1]]
+            save_tile(strain_pairs, tile, rows, cols, tile_id, progress)
     return strain_pairs
 
 
@@ -110,51 +445,84 @@ def tests1():
     assert(get_pair_unique2(m, 1, 0) == 1)
     assert(get_pair_unique2(m, 0, 2) == 0)
     assert(get_pair_unique2(m, 2, 3) == 0)
-    print 'tests pass'
-
 
-# Makes a single table containing all four types of output
-def make_output(strain_pairs, col_headings, num_strains):
+    # Both matrix engines agree with the pair by pair counts
+    m = np.random.RandomState(0).rand(140, 6) < 0.5
+    m[0] = True
+    m[1] = False
+    m[1, 2] = True
+    pair_unique_mat = m[np.sum(m, axis=1) == 2, :]
+    for kernel in sorted(KERNELS):
+        strain_pairs = compare_all_strain_pairs(m, 6, kernel=kernel)
+        for i in range(6):
+            for j in range(i + 1, 6):
+                assert(strain_pairs.sim[i, j] == get_sim2(m[:, i], m[:, j]))
+                assert(strain_pairs.diff[i, j] == get_diff2(m[:, i], m[:, j]))
+                assert(strain_pairs.pair_unique[i, j] ==
+                       get_pair_unique2(pair_unique_mat, i, j))
+    print('tests pass')
+
+
+# Yields the lines of a single table containing all four types of output
+def iter_output(strain_pairs, col_headings, num_strains):
     prefix = ''
-    output = list()
-    output.append("Strain\t" + '\t'.join(col_headings[1:]))
+    yield "Strain\t" + '\t'.join(col_headings[1:])
     row_labels = ['\tSimilarity', '\tDifference', '\tComparison',
                   '\tPairUnique']
 
-    for row in xrange(num_strains - 1):
-        for i in xrange(4):
+    for row in range(num_strains - 1):
+        for i in range(4):
             curr = [prefix + col_headings[row]]
-            for col in xrange(row + 1, num_strains):
-                curr.append(strain_pairs[(row, col)][i])
-            output.append('\t'.join(map(str, curr)) + row_labels[i])
+            curr.extend(strain_pairs[i][row, row + 1:])
+            yield '\t'.join(map(str, curr)) + row_labels[i]
         prefix += '\t'
-    return '\n'.join(output)
 
 
-# Makes three tables for the similarity, difference and pair unique output
-def make_output_3(strain_pairs, col_headings, num_strains):
-    row_labels = ['similarity', 'difference', 'comparison', 'pair_unique']
-    rev_col_headings = list(reversed(col_headings[1:]))
-    outputs = []
-    
-    for i in [0, 1, 3]:
-        output = list()
-        output.append("Strain\t" + '\t'.join(rev_col_headings))
-        for row in xrange(num_strains - 1):
-            curr = [col_headings[row]]
+# Makes a single table containing all four types of output
+def make_output(strain_pairs, col_headings, num_strains):
+    return '\n'.join(iter_output(strain_pairs, col_headings, num_strains))
+
 
-            for col in list(reversed(xrange(row + 1, num_strains))):
-                curr.append(strain_pairs[(row, col)][i])
-            output.append('\t'.join(map(str, curr)))
-        outputs.append(('\n'.join(output), row_labels[i]))
+# Output types written as their own tables, (PairCounts index, name)
+SINGLE_TABLES = [(0, 'similarity'), (1, 'difference'), (3, 'pair_unique')]
 
-    return outputs
+
+# Yields the lines of the table for the output type specified by index
+def iter_output_3(strain_pairs, col_headings, num_strains, index):
+    rev_col_headings = list(reversed(col_headings[1:]))
+    yield "Strain\t" + '\t'.join(rev_col_headings)
+    for row in range(num_strains - 1):
+        curr = [col_headings[row]]
+        curr.extend(strain_pairs[index][row, :row:-1])
+        yield '\t'.join(map(str, curr))
 
 
-# Gets all data values for the output type specified by index
-# example:  returns all pairwise similarity counts
-def get_all_values(strain_pairs, index):
-    return [val[index] for k, val in strain_pairs.items()]
+# Makes three tables for the similarity, difference and pair unique output
+def make_output_3(strain_pairs, col_headings, num_strains):
+    return [('\n'.join(iter_output_3(strain_pairs, col_headings, num_strains,
+                                     i)), table_type)
+            for i, table_type in SINGLE_TABLES]
+
+
+# Input is a strain x strain matrix
+# Returns the min, max, mean and standard deviation of the values above the
+# diagonal.  This goes one row at a time so memmaps are never fully loaded.
+def get_upper_stats(mat):
+    num_vals = 0
+    total = 0
+    total_sq = 0
+    lo = np.iinfo(np.int64).max
+    hi = np.iinfo(np.int64).min
+    for row in range(mat.shape[0] - 1):
+        vals = np.asarray(mat[row, row + 1:], dtype=np.int64)
+        num_vals += len(vals)
+        total += int(np.sum(vals))
+        total_sq += int(np.dot(vals, vals))
+        lo = min(lo, np.min(vals))
+        hi = max(hi, np.max(vals))
+    mean = np.float64(total) / num_vals
+    var = np.float64(num_vals * total_sq - total * total) / num_vals ** 2
+    return lo, hi, mean, np.sqrt(var)
 
 
 # Computes the min, max, mean and standard deviation for the four output types
@@ -163,40 +531,118 @@ def calc_stats(strain_pairs):
     col_labels = ['Min', 'Max', 'Mean', 'StdDev']
     output = list()
     output.append('\t' + '\t'.join(col_labels))
-    for i in xrange(4):
+    for i in range(4):
         curr = [row_labels[i]]
-        vals = get_all_values(strain_pairs, i)
-        curr.append(min(vals))
-        curr.append(max(vals))
-        curr.append(np.mean(vals))
-        curr.append(np.std(vals))
+        curr.extend(get_upper_stats(strain_pairs[i]))
         output.append('\t'.join(map(str, curr)))       
     return '\n'.join(output)
 
 
+# Writes the strain names and the PairCounts matrices to an uncompressed .npz
+# bundle, read by pairwise_outliers.py --npz.  Only the entries above the
+# diagonal are meaningful.
+def write_npz(strain_pairs, col_headings, file_name):
+    strains = [x.decode('utf-8') if isinstance(x, bytes) else x
+               for x in col_headings]
+    arrays = dict(zip(PairCounts._fields, strain_pairs))
+    np.savez(file_name, strains=np.array(strains), **arrays)
+
+
 def write_output(text, file_name):
     with open(file_name, 'w') as the_file:
         the_file.write(text)
 
 
-def main():
-    in_folder = sys.argv[1]
-    out_folder = sys.argv[2]
-    nickname = out_folder + '/' + sys.argv[3]
-    
-    poss_mat, col_headings = get_pres_abs_mat(in_folder)
+# Writes the lines to the file separated by newlines without holding the
+# whole file as one string
+def write_lines(lines, file_name):
+    with open(file_name, 'w') as the_file:
+        for index, line in enumerate(lines):
+            if index > 0:
+                the_file.write('\n')
+            the_file.write(line)
+
+
+# Input is an argparse parser
+# Adds the options for making the tables from a loaded matrix, shared with
+# roary_analysis.py
+def add_arguments(parser):
+    parser.add_argument('out_folder', help='folder for the output tables')
+    parser.add_argument('nickname', help='prefix for the output files')
+    parser.add_argument('--block-size', type=int, default=0,
+                        help='compute the tables in tiles of this many '
+                             'strains, stored in memory mapped .npy files in '
+                             'the output folder.  Rerunning with the same '
+                             'block size resumes from the finished tiles.')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of processes used to compute the tiles')
+    parser.add_argument('--kernel', choices=sorted(KERNELS), default='blas',
+                        help='count shared genes with float matrix products '
+                             '(blas, faster) or with popcounts of the bit '
+                             'packed matrix (popcount, 8x less memory for '
+                             'the matrix once the input is cached)')
+    parser.add_argument('--npz', action='store_true',
+                        help='also write the matrices and strain names to '
+                             'nickname_pairwise.npz for pairwise_outliers.py')
+    parser.add_argument('--no-text', action='store_true',
+                        help="don't write the text tables, only the stats "
+                             "(and the .npz)")
+
+
+def get_options():
+    parser = argparse.ArgumentParser(
+        description='Pairwise gene count tables for the strains in a roary run')
+    parser.add_argument('in_folder', help='folder with the roary output')
+    add_arguments(parser)
+    parser.add_argument('--mmap', action='store_true',
+                        help='memory map the cached packed gene presence '
+                             'matrix instead of loading a private copy (the '
+                             'boolean matrix is still unpacked in memory)')
+    return parser.parse_args()
+
+
+# Inputs are the add_arguments options, the gene presence matrix (passing
+# it bit packed for --kernel popcount saves packing it), the strain names
+# and the rr.get_fingerprint of the input file, which --block-size needs to
+# resume tiles
+# Writes the pairwise tables and their summary statistics
+def make_tables(options, poss_mat, col_headings, fingerprint=None):
+    nickname = options.out_folder + '/' + options.nickname
     num_strains = len(col_headings)
-    tests1()
 
-    strain_pairs = compare_all_strain_pairs(poss_mat, num_strains)
-
-    text = make_output(strain_pairs, col_headings, num_strains)
-    write_output(text, nickname + "_pairwise_table.txt")
-    single_tables = make_output_3(strain_pairs, col_headings, num_strains)
-    for (data, table_type) in single_tables:
-        write_output(data, nickname + "_pairwise_" + table_type + "_table.txt")
+    if options.block_size > 0:
+        strain_pairs = compare_all_strain_pairs_tiled(poss_mat, num_strains,
+                                                      nickname,
+                                                      options.block_size,
+                                                      options.jobs,
+                                                      options.kernel,
+                                                      fingerprint)
+    else:
+        strain_pairs = compare_all_strain_pairs(poss_mat, num_strains,
+                                                options.jobs, options.kernel)
+
+    if options.npz:
+        write_npz(strain_pairs, col_headings, nickname + "_pairwise.npz")
+    if not options.no_text:
+        lines = iter_output(strain_pairs, col_headings, num_strains)
+        write_lines(lines, nickname + "_pairwise_table.txt")
+        for i, table_type in SINGLE_TABLES:
+            lines = iter_output_3(strain_pairs, col_headings, num_strains, i)
+            write_lines(lines,
+                        nickname + "_pairwise_" + table_type + "_table.txt")
     text = calc_stats(strain_pairs) 
     write_output(text, nickname + "_pairwise_table_stats.txt")
 
+
+def main():
+    options = get_options()
+    poss_mat, col_headings = get_pres_abs_mat(options.in_folder, options.mmap,
+                                              options.kernel == 'popcount')
+    tests1()
+    fingerprint = rr.get_fingerprint(options.in_folder +
+                                     "/gene_presence_absence.csv")
+    make_tables(options, poss_mat, col_headings, fingerprint)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+# Author:  Rachel Ehrlich
+# This program makes the figures for many roary runs in one process, so
+# matplotlib and the other plotting libraries are only imported once.  It
+# takes a tab separated manifest with a header line and one run per line:
+#   nickname      prefix for the figures
+#   roary_output  folder with the roary output (for blastp, the folder of
+#                 blastp folders)
+#   outdir        folder with the run's results, where the figures go
+#   figures       comma separated list of figures to make:
+#                 rtab            plot_rtab.py plots
+#                 rtab_summary    plot_rtab.py --summary plots
+#                 tree_heatmap    tree_heatmap.py plots
+#                 fsgm            plot_fsgm_results.py plots
+#                 blastp          plot_blastp_comparison.py plot
+#   tree          (optional) newick file for tree_heatmap, by default
+#                 roary_output/accessory_binary_genes.fa.newick
+# Lines starting with # are ignored.  The figures of a run share its loaded
+# gene presence matrix.  --jobs N renders N runs at a time in a process pool.
+# Figures are drawn with the non-interactive Agg backend.
+# Example usage:
+# python plot_batch.py runs.tsv --jobs 4
+
+import argparse
+import multiprocessing
+import sys
+import time
+import traceback
+from collections import namedtuple
+import plot_blastp_comparison
+import plot_fsgm_results
+import plot_rtab
+import roary_reader as rr
+import tree_heatmap
+
+Run = namedtuple('Run', ['nickname', 'roary_output', 'outdir', 'figures',
+                         'tree'])
+
+FIGURES = ['rtab', 'rtab_summary', 'tree_heatmap', 'fsgm', 'blastp']
+REQUIRED_COLUMNS = ['nickname', 'roary_output', 'outdir', 'figures']
+DEFAULT_TREE = '/accessory_binary_genes.fa.newick'
+
+
+# Input is the manifest file name
+# Returns a list of Runs
+def read_manifest(file_name):
+    with open(file_name, 'r') as f:
+        lines = [x.rstrip('\r\n') for x in f]
+    lines = [x for x in lines if len(x.strip()) > 0 and not x.startswith('#')]
+    header = lines[0].split('\t')
+    missing = [x for x in REQUIRED_COLUMNS if x not in header]
+    if len(missing) > 0:
+        raise ValueError('%s has no %s column' % (file_name, ', '.join(missing)))
+
+    runs = list()
+    for line in lines[1:]:
+        fields = dict(zip(header, line.split('\t')))
+        figures = [x.strip() for x in fields['figures'].split(',')]
+        unknown = [x for x in figures if x not in FIGURES]
+        if len(unknown) > 0:
+            raise ValueError('%s: unknown figures %s' %
+                             (fields['nickname'], ', '.join(unknown)))
+        tree = fields.get('tree', '')
+        if len(tree) == 0:
+            tree = fields['roary_output'] + DEFAULT_TREE
+        runs.append(Run(fields['nickname'], fields['roary_output'],
+                        fields['outdir'], figures, tree))
+    return runs
+
+
+class RunData(object):
+    """
+    Data loaded for one run, shared by its figures
+    """
+
+    def __init__(self, run):
+        self.run = run
+        self._gpa = None
+
+    def gene_pres_abs(self):
+        """
+        :return: the run's GenePresAbs, read the first time it is needed
+        """
+        if self._gpa is None:
+            self._gpa = rr.read_gene_pres_abs(self.run.roary_output +
+                                              '/gene_presence_absence.csv')
+        return self._gpa
+
+
+# Inputs are the figure name and the run's RunData
+# Makes the figure's plots
+def make_figure(figure, data):
+    run = data.run
+    if figure == 'rtab':
+        plot_rtab.make_all_plots(run.roary_output, run.outdir, run.nickname)
+    elif figure == 'rtab_summary':
+        plot_rtab.make_all_plots(run.roary_output, run.outdir, run.nickname,
+                                 summary=True)
+    elif figure == 'fsgm':
+        plot_fsgm_results.make_all_plots(run.outdir, run.nickname)
+    elif figure == 'blastp':
+        counts = plot_blastp_comparison.get_all_summary_stats(run.roary_output)
+        plot_blastp_comparison.plot_counts(
+            counts, run.outdir + '/' + run.nickname + '_blastp_comparison')
+    elif figure == 'tree_heatmap':
+        gpa = data.gene_pres_abs()
+        tree_heatmap.make_all_plots(run.tree, gpa.presence, gpa.strain_names,
+                                    run.outdir + '/' + run.nickname + '_')
+
+
+# Input is a Run
+# Makes all the run's figures, one failing doesn't stop the others
+# Returns the run's nickname and a list of (figure, seconds, error message
+# or None)
+def render_run(run):
+    # matplotlib is only imported once there is something to draw
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    data = RunData(run)
+    results = list()
+    for figure in run.figures:
+        start = time.time()
+        error = None
+        try:
+            make_figure(figure, data)
+        except Exception:
+            error = traceback.format_exc()
+        finally:
+            plt.close('all')
+        results.append((figure, time.time() - start, error))
+    return run.nickname, results
+
+
+# Inputs are a list of Runs and the number of processes
+# Yields the output of render_run for each run as it finishes
+def render_runs(runs, jobs=1):
+    if jobs <= 1:
+        for run in runs:
+            yield render_run(run)
+        return
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap_unordered(render_run, runs):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def get_options():
+    parser = argparse.ArgumentParser(
+        description='Make the figures for many roary runs in one process')
+    parser.add_argument('manifest', help='tab separated file of runs')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of runs rendered at the same time')
+    return parser.parse_args()
+
+
+def main():
+    options = get_options()
+    runs = read_manifest(options.manifest)
+    failed = 0
+    for nickname, results in render_runs(runs, options.jobs):
+        for figure, seconds, error in results:
+            status = 'ok' if error is None else 'failed'
+            sys.stderr.write('%s\t%s\t%s\t%.1fs\n' %
+                             (nickname, figure, status, seconds))
+            if error is not None:
+                sys.stderr.write(error)
+                failed += 1
+    if failed > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
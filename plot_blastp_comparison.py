@@ -8,12 +8,29 @@
 # Example usage:
 # python plot_blastp_comparison.py /home/rachel/Data/pg/roary_except_MB1843_no_delete cluster_freq_blastp
 # The above command creates HFlu_blastP_plot.pdf in your current directory
+# The folders are scanned by --threads threads.  Each folder's counts are
+# saved in a small .plot_blastp_comparison.json file inside it, and reused
+# while the files they were counted from are unchanged.
+# With --sweep, plot_name_sweep.tsv is written instead of the plot.  It has one
+# row per blastp folder with the cluster type counts, split/unsplit paralog
+# group counts and pairwise similarity and difference statistics, all
+# computed from each folder's gene_presence_absence.csv in --jobs processes.
 
 
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
+from multiprocessing.pool import ThreadPool
+import multiprocessing
+import argparse
+import io
+import json
 import os
-import sys
+import find_paralogs as fp
+import pairwise_table as pt
+import roary_reader as rr
+from lazy_import import LazyModule
+
+plt = LazyModule('matplotlib.pyplot')
+backend_pdf = LazyModule('matplotlib.backends.backend_pdf')
+np = LazyModule('numpy')
 
 # Input is a line from roary's summary_statistics.txt file
 # Output is the gene count for that line
@@ -21,19 +38,83 @@ def get_num(data):
     num = data.split(":")[1].strip()
     return int(num)
 
+READ_SIZE = 1 << 20
+
 # Input is a folder and a file name
-# Output is the number of lines (gene clusters) in the files
+# Output is the number of lines (gene clusters) in the files, counting the
+# newlines a megabyte at a time
 def get_num_lines(direc, file_name):
     num_lines = 0
-    with open(direc + file_name, 'rU') as f:
-        for line in f:
-            num_lines += 1
+    last = b'\n'
+    with open(direc + file_name, 'rb') as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            num_lines += data.count(b'\n')
+            last = data[-1:]
+    # A last line without a newline is still a line
+    if last != b'\n':
+        num_lines += 1
     return num_lines
 
-# Input is the directory that contains the folders of roary output
+CACHE_FILE = "/.plot_blastp_comparison.json"
+CACHE_VERSION = 1
+SCANNED_FILES = ["/summary_statistics.txt", "/_inflated_unsplit_mcl_groups",
+                 "/_inflated_mcl_groups"]
+
+# Input is a roary output folder
+# Output is the size and modification time of each file the counts come from
+def get_file_stamps(direc):
+    stamps = dict()
+    for file_name in SCANNED_FILES:
+        stat = os.stat(direc + file_name)
+        stamps[file_name] = [stat.st_size, stat.st_mtime]
+    return stamps
+
+# Input is a roary output folder
+# Output is a dict of the folder's gene cluster counts
+def scan_folder(direc):
+    with io.open(direc + "/summary_statistics.txt", 'r') as f:
+        file_contents = f.read().split('\n')
+    counts = dict()
+    for i, group in enumerate(['core', 'soft', 'shell', 'cloud', 'total']):
+        counts[group] = get_num(file_contents[i])
+    counts['unsplit'] = get_num_lines(direc, "/_inflated_unsplit_mcl_groups")
+    counts['split'] = get_num_lines(direc, "/_inflated_mcl_groups")
+    return counts
+
+# Inputs are a roary output folder and whether to use its cache file
+# Output is a dict of the folder's gene cluster counts, from the cache file
+# when the files haven't changed since it was written.  Otherwise the folder
+# is scanned and the cache file rewritten (if the folder is writable).
+def get_folder_stats(direc, use_cache=True):
+    if not use_cache:
+        return scan_folder(direc)
+
+    stamps = get_file_stamps(direc)
+    try:
+        with open(direc + CACHE_FILE, 'r') as f:
+            cache = json.load(f)
+        if cache['version'] == CACHE_VERSION and cache['files'] == stamps:
+            return cache['counts']
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+
+    counts = scan_folder(direc)
+    cache = {'version': CACHE_VERSION, 'files': stamps, 'counts': counts}
+    try:
+        with open(direc + CACHE_FILE, 'w') as f:
+            json.dump(cache, f)
+    except (IOError, OSError):
+        pass
+    return counts
+
+# Input is the directory that contains the folders of roary output, the
+# number of threads scanning folders and whether to use the cache files
 # Outputs lists of counts for core, soft, shell, cloud, unsplit, split groups
 # and the folder names (blastp)
-def get_all_summary_stats(roary_output_dir):
+def get_all_summary_stats(roary_output_dir, threads=8, use_cache=True):
     core = []
     soft = []
     shell = []
@@ -43,32 +124,89 @@ def get_all_summary_stats(roary_output_dir):
     total = []
     blastp = []
 
-    for folder in os.listdir(roary_output_dir):
-        if not os.path.isdir(roary_output_dir + '/' + folder):
-            continue
-        direc = roary_output_dir + '/' + folder
-
-        with open(direc + "/summary_statistics.txt", 'rU') as f:
-            file_contents = f.read().split('\n')
-            
-        core.append(get_num(file_contents[0]))
-        soft.append(get_num(file_contents[1]))
-        shell.append(get_num(file_contents[2]))
-        cloud.append(get_num(file_contents[3]))
-        total.append(get_num(file_contents[4]))
+    folders = [x for x in os.listdir(roary_output_dir)
+               if os.path.isdir(roary_output_dir + '/' + x)]
+    direcs = [roary_output_dir + '/' + x for x in folders]
+    pool = ThreadPool(max(1, threads))
+    try:
+        all_counts = pool.map(lambda x: get_folder_stats(x, use_cache), direcs)
+    finally:
+        pool.close()
+        pool.join()
+
+    for folder, counts in zip(folders, all_counts):
+        core.append(counts['core'])
+        soft.append(counts['soft'])
+        shell.append(counts['shell'])
+        cloud.append(counts['cloud'])
+        total.append(counts['total'])
         blastp.append(int(folder))
 
-        unsplit.append(get_num_lines(direc, "/_inflated_unsplit_mcl_groups"))
-        split.append(get_num_lines(direc, "/_inflated_mcl_groups"))
+        unsplit.append(counts['unsplit'])
+        split.append(counts['split'])
         assert(split == total)
         
     return (core, soft, shell, cloud, unsplit, split, blastp)
     
 
+SWEEP_COLUMNS = ['blastp', 'strains', 'clusters', 'core', 'soft_core', 'shell',
+                 'cloud', 'split', 'unsplit', 'split_unsplit_ratio',
+                 'similarity_min', 'similarity_max', 'similarity_mean',
+                 'similarity_sd', 'difference_min', 'difference_max',
+                 'difference_mean', 'difference_sd']
+
+# Input is a (blastp, roary output folder) pair, run in a worker process
+# Output is the folder's row of the sweep table, the values for SWEEP_COLUMNS.
+# The presence matrix is read once (from the reader's cache when it has one)
+# and used for both the cluster types and the pairwise comparisons.
+def analyze_folder(folder_info):
+    blastp, direc = folder_info
+    gpa = rr.read_gene_pres_abs(direc + "/gene_presence_absence.csv")
+    presence = gpa.presence
+    ranges, num_clusters = fp.classify_clusters(np.sum(presence, axis=1),
+                                                gpa.num_strains,
+                                                fp.DEFAULT_CUTOFFS)
+    cloud, shell, soft, core = num_clusters
+    split = get_num_lines(direc, "/_inflated_mcl_groups")
+    unsplit = get_num_lines(direc, "/_inflated_unsplit_mcl_groups")
+    ratio = np.float64(split) / unsplit if unsplit > 0 else np.nan
+
+    row = [blastp, gpa.num_strains, gpa.num_genes, core, soft, shell, cloud,
+           split, unsplit, ratio]
+    strain_pairs = pt.compare_all_strain_pairs(presence, gpa.num_strains)
+    row.extend(pt.get_upper_stats(strain_pairs.sim))
+    row.extend(pt.get_upper_stats(strain_pairs.diff))
+    return row
+
+# Inputs are the directory that contains the folders of roary output, the
+# output file name and the number of processes
+# Writes a tab separated table with a row of SWEEP_COLUMNS for each folder,
+# sorted by blastp
+def make_sweep_table(roary_output_dir, out_file, jobs=1):
+    folders = [(int(x), roary_output_dir + '/' + x)
+               for x in os.listdir(roary_output_dir)
+               if os.path.isdir(roary_output_dir + '/' + x)]
+    folders.sort()
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            rows = pool.map(analyze_folder, folders)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        rows = [analyze_folder(x) for x in folders]
+
+    with open(out_file, 'w') as f:
+        f.write('\t'.join(SWEEP_COLUMNS) + '\n')
+        for row in rows:
+            f.write('\t'.join(map(str, row)) + '\n')
+
 # Inputs are the gene counts and the output file name
 # This plots the counts for each gene group vs the blastP percentage
-def plot_counts((core, soft, shell, cloud, unsplit, split, blastp), plot_name):
-    with PdfPages(plot_name + '.pdf') as pdf:
+def plot_counts(summary_counts, plot_name):
+    core, soft, shell, cloud, unsplit, split, blastp = summary_counts
+    with backend_pdf.PdfPages(plot_name + '.pdf') as pdf:
         plt.plot(blastp, core, 'ro', label='core (99-100% of strains)')
         plt.plot(blastp, soft, 'bs', label='soft core (95-99% of strains)')
         plt.plot(blastp, shell, 'gd', label='shell (15-95% of strains)')
@@ -83,12 +221,36 @@ def plot_counts((core, soft, shell, cloud, unsplit, split, blastp), plot_name):
         pdf.savefig()
         plt.close()  
 
+def get_options():
+    parser = argparse.ArgumentParser(
+        description='Plot gene cluster counts against blastp percent identity')
+    parser.add_argument('roary_output_dir',
+                        help='folder of roary output folders named by blastp')
+    parser.add_argument('plot_name', help='output pdf name without .pdf')
+    parser.add_argument('--threads', type=int, default=8,
+                        help='number of folders scanned at the same time')
+    parser.add_argument('--no-cache', action='store_true',
+                        help="rescan every folder, ignoring their cache files")
+    parser.add_argument('--sweep', action='store_true',
+                        help='write plot_name_sweep.tsv with per folder '
+                             'cluster, paralog and pairwise statistics '
+                             'instead of the plot')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of folders analyzed at the same time '
+                             'with --sweep')
+    return parser.parse_args()
+
 def main():
-    roary_output_dir = sys.argv[1]
-    plot_name = sys.argv[2]
+    options = get_options()
+    if options.sweep:
+        make_sweep_table(options.roary_output_dir,
+                         options.plot_name + '_sweep.tsv', options.jobs)
+        return
 
-    summary_counts = get_all_summary_stats(roary_output_dir)
-    plot_counts(summary_counts, plot_name)
+    summary_counts = get_all_summary_stats(options.roary_output_dir,
+                                           options.threads,
+                                           not options.no_cache)
+    plot_counts(summary_counts, options.plot_name)
 
 if __name__ == "__main__":
     main()
@@ -4,10 +4,13 @@
 # two plots of the data, the likelihood of various N values and the number of
 # expected new genes per strain sequenced.
 
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
+import argparse
+import io
 import operator
-import sys
+from lazy_import import LazyModule
+
+plt = LazyModule('matplotlib.pyplot')
+backend_pdf = LazyModule('matplotlib.backends.backend_pdf')
 
 # Input is a list of strings that are ints with possible white space
 # Returns a list of ints
@@ -26,7 +29,7 @@ def get_genes_per_genome_data(my_file):
     in_total = False
     total = list()
 
-    with open(my_file, 'rU') as f:
+    with io.open(my_file, 'r') as f:
         for line in f:
             if line.startswith("core_stdv ="):
                  in_total = False
@@ -49,17 +52,18 @@ def get_genes_per_genome_data(my_file):
 # Input is a tuple with lists of counts for core, new and total genes, an
 # output file name and the most likely value for n.  Writes a pdf plot to the
 # output file
-def plot_genes_per_genome((core, new_genes, total), out_file, best_n=0):
+def plot_genes_per_genome(genes_per_genome, out_file, best_n=0):
+    core, new_genes, total = genes_per_genome
     num_genomes = range(1, len(new_genes) + 1)
 
-    with PdfPages(out_file) as pdf:
+    with backend_pdf.PdfPages(out_file) as pdf:
         plt.plot(num_genomes, new_genes, 'ro', label='new')
         plt.plot(num_genomes, total, 'bs', label='total')
         plt.plot(num_genomes, core, 'g^', label='core')
 
         if best_n > 0:
             plt.axhline(best_n, color = 'k')
-            plt.annotate(s='N=' + str(best_n), xy=(5, best_n - 120))
+            plt.annotate('N=' + str(best_n), xy=(5, best_n - 120))
         
         plt.xlabel("Number of genomes")
         plt.ylabel('Number of genes')
@@ -71,7 +75,7 @@ def plot_genes_per_genome((core, new_genes, total), out_file, best_n=0):
 # Input is the likelihood file from the fsgm program
 # returns a list of n values and a lis of their likelihoods
 def get_lik_data(my_file):
-    with open(my_file, 'rU') as f:
+    with io.open(my_file, 'r') as f:
         data = f.read()
     split_data = [x.split('\t') for x in data.split('\n') if len(x) > 0]
     n = [int(x[0]) for x in split_data]
@@ -81,14 +85,14 @@ def get_lik_data(my_file):
 # Graphs the n against lik and saves the results to out_file
 # Returns the most likely value of n
 def plot_lik_vs_n(n, lik, out_file):
-    with PdfPages(out_file) as pdf:
+    with backend_pdf.PdfPages(out_file) as pdf:
         plt.plot(n, lik, 'ko')
         plt.xlabel("Number of genes")
         plt.ylabel('Log likelihood')
         max_index, max_lik = max(enumerate(lik), key=operator.itemgetter(1))
         best_n = n[max_index]
         label = '(' + str(best_n) + ' ,' + str(max_lik) + ')'
-        plt.annotate(s=label, xy=(best_n, max_lik),
+        plt.annotate(label, xy=(best_n, max_lik),
                      xytext=(best_n + 500, max_lik - 40),
                      arrowprops=dict(facecolor='red', shrink=0.05))
         plt.title("Number of genes in the pan genome")
@@ -96,9 +100,9 @@ def plot_lik_vs_n(n, lik, out_file):
         plt.close()
     return best_n
     
-def main():
-    out_dir = sys.argv[1]
-    nickname = sys.argv[2]
+# Inputs are the folder with the fsgm output and the nickname
+# Makes the likelihood and genes per genome plots in out_dir
+def make_all_plots(out_dir, nickname):
     fsgm_lik_file = out_dir + "/N_vs_likelihood_" + nickname + ".txt"
     fsgm_file = out_dir + "/CommandWindow_" + nickname + ".txt"
     
@@ -112,5 +116,17 @@ def main():
     plot_genes_per_genome(genes_per_genome, out_file, best_n)
 
 
+def get_options():
+    parser = argparse.ArgumentParser(description='Plot the fsgm results')
+    parser.add_argument('out_dir', help='folder with the fsgm output')
+    parser.add_argument('nickname', help='nickname used for the fsgm run')
+    return parser.parse_args()
+
+
+def main():
+    options = get_options()
+    make_all_plots(options.out_dir, options.nickname)
+
+
 if __name__ == "__main__":
     main()
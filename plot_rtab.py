@@ -7,17 +7,20 @@
 # This makes two plots, one from the roary Rtab data and one from
 # the simulated gene frequency data.
 
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
-import sys
+import argparse
+import io
 import os
+from lazy_import import LazyModule
+
+plt = LazyModule('matplotlib.pyplot')
+backend_pdf = LazyModule('matplotlib.backends.backend_pdf')
 
 # Input is a list of lines from an rtab file output by roary
 # Returns a list where each element is a list of integers from 
 # the corresponding line
 def rtab_to_list_of_lists(data):
     lol = [x.replace('\n','').split('\t') for x in data]
-    lol_ints = [map(int, x) for x in lol]
+    lol_ints = [[int(y) for y in x] for x in lol]
     return lol_ints
 
 # Input is a folder containing .Rtab files and a list of those files
@@ -26,16 +29,17 @@ def rtab_to_list_of_lists(data):
 def get_rtab_data(path, files):
     data = []
     for x in files:
-        with open(path + '/' + x, 'rU') as f:
+        with io.open(path + '/' + x, 'r') as f:
             data.append(rtab_to_list_of_lists(f.readlines()))
     return data
 
 # Input is a list with the core, total, new_genes and unique rtab data and
 # an output file
 # Creates a pdf with a line plot of the data
-def make_plots((core, total, new_genes, unique), out_file):
+def make_plots(rtab_data, out_file):
+    core, total, new_genes, unique = rtab_data
     num_genomes = range(1, len(core[0]) + 1)
-    with PdfPages(out_file) as pdf:
+    with backend_pdf.PdfPages(out_file) as pdf:
         for i in range(len(new_genes)):
             plt.plot(num_genomes, new_genes[i], 'r', label = "new")
             plt.plot(num_genomes, total[i], 'b', label = 'total')
@@ -61,7 +65,7 @@ def make_plots2(data, labels, out_file):
 
     colors = ['m', 'g', 'b', 'r']
 
-    with PdfPages(out_file) as pdf:
+    with backend_pdf.PdfPages(out_file) as pdf:
         for sim_num in range(num_simulations):
             all_bin_data = [x[sim_num] for x in data]
             
@@ -78,6 +82,86 @@ def make_plots2(data, labels, out_file):
         pdf.savefig()
         plt.close()
 
+# Input is a summary file written by simulate_pan_genome.py --summary
+# Returns a dict from the statistic name (mean, sd, q0.5...) to a list of
+# floats with one value per number of genomes
+def read_summary(file_name):
+    summary = dict()
+    with io.open(file_name, 'r') as f:
+        for line in f.readlines()[1:]:
+            split_line = line.replace('\n', '').split('\t')
+            summary[split_line[0]] = [float(x) for x in split_line[1:]]
+    return summary
+
+
+# Input is a list of summaries from read_summary, a list of labels,
+# and an output file
+# Creates a pdf with the median of the simulations for each cutoff and a band
+# between the lowest and highest quantile
+def make_summary_plots(summaries, labels, out_file):
+    colors = ['m', 'g', 'b', 'r']
+
+    with backend_pdf.PdfPages(out_file) as pdf:
+        for summary, label, color in zip(summaries, labels, colors):
+            num_genomes = range(1, len(summary['mean']) + 1)
+            quantiles = sorted((float(x[1:]), x) for x in summary
+                               if x.startswith('q'))
+            middle = summary.get('q0.5', summary['mean'])
+            if len(quantiles) > 1:
+                band = quantiles[0][1] + '-' + quantiles[-1][1]
+                plt.fill_between(num_genomes, summary[quantiles[0][1]],
+                                 summary[quantiles[-1][1]], color=color,
+                                 alpha=0.25, linewidth=0)
+                label = label + ' (' + band + ')'
+            plt.plot(num_genomes, middle, color, label=label)
+
+        plt.legend(loc=0)
+        plt.xlabel("Number of genomes")
+        plt.ylabel('Number of genes')
+        plt.title("Median simulated gene frequency per strain sequenced")
+
+        pdf.savefig()
+        plt.close()
+
+
+# Input is a directoy containing the output from simulate_pan_genome.py
+# --summary
+# Returns a list of the summary files and a list of their cutoffs sorted
+# by cutoffs
+def get_summary_files(outdir, nickname):
+    data = []
+    suffix = '_summary.tsv'
+    for file1 in os.listdir(outdir):
+        if not file1.endswith(suffix):
+            continue
+        split_file = file1[:-len(suffix)].rsplit('_', 1)
+        if len(split_file) == 2 and split_file[0] == nickname:
+            data.append((split_file[1], file1))
+
+    data.sort(key=lambda x: float(x[0]))
+
+    files = [x[1] for x in data]
+    cutoffs = [x[0] for x in data]
+    return files, cutoffs
+
+
+# Input is an argparse parser
+# Adds the options for everything but the roary folder, shared with
+# roary_analysis.py
+def add_arguments(parser):
+    parser.add_argument('outdir', help='folder with the simulation results')
+    parser.add_argument('nickname', help='nickname used for the simulations')
+    parser.add_argument('--summary', action='store_true',
+                        help='plot the median and quantile bands from '
+                             'simulate_pan_genome.py --summary output')
+
+def get_options():
+    parser = argparse.ArgumentParser(
+        description='Plots the roary and simulated pan genome curves')
+    parser.add_argument('roary_output', help='folder with the roary output')
+    add_arguments(parser)
+    return parser.parse_args()
+
 # Input is a directoy containing the output from simulate_pan_genome.py
 # Returns a list of the .Rtab files and a list of their cutoffs sorted
 # by cutoffs
@@ -97,22 +181,33 @@ def get_simulated_files(outdir, nickname):
     cutoffs = [x[0] for x in data]
     return files, cutoffs
                
-def main():
-    roary_output = sys.argv[1]
-    outdir = sys.argv[2]
-    nickname = sys.argv[3]
-    
+# Inputs are the roary output folder, the folder with the
+# simulate_pan_genome.py output, the nickname and whether that output is
+# --summary files
+# Makes the observed genome size and gene frequency plots in outdir
+def make_all_plots(roary_output, outdir, nickname, summary=False):
     roary_files = ["/number_of_conserved_genes.Rtab",
                    "/number_of_genes_in_pan_genome.Rtab",
                    "/number_of_new_genes.Rtab", "/number_of_unique_genes.Rtab"]
     data = get_rtab_data(roary_output, roary_files)
     make_plots(data, outdir + '/' + nickname + '_observed_genome_size.pdf')
     
+    plot_file =  outdir + '/' + nickname + '_observed_gene_frequencies.pdf'
+    if summary:
+        summary_files, cutoffs = get_summary_files(outdir, nickname)
+        summaries = [read_summary(outdir + '/' + x) for x in summary_files]
+        make_summary_plots(summaries, cutoffs, plot_file)
+        return
+
     sim_files, cutoffs = get_simulated_files(outdir, nickname)
 
     data = get_rtab_data(outdir, sim_files)
-    plot_file =  outdir + '/' + nickname + '_observed_gene_frequencies.pdf'
-    make_plots2(data, map(str, cutoffs), plot_file)
+    make_plots2(data, [str(x) for x in cutoffs], plot_file)
+
+def main():
+    options = get_options()
+    make_all_plots(options.roary_output, options.outdir, options.nickname,
+                   options.summary)
 
 if __name__ == "__main__":
     main()
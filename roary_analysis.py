@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Author:  Rachel Ehrlich
+One command for the python analyses of a roary run.  Commands are separated
+by + and run in order in one process.  load reads gene_presence_absence.csv
+once and the commands after it use the matrix already in memory instead of
+each reading the roary folder again:
+roary-analysis load roary_dir + paralogs outdir nick + pairwise outdir nick \
+    --jobs 4 + simulate outdir nick 0.15,0.95,0.99,1.0 5 + fsgm-input
+Each command takes the options of the script it runs, without the roary
+folder, which comes from load (ex roary-analysis pairwise -h).  Every command
+is parsed before the first one runs, so a typo in the last command doesn't
+waste the earlier ones.  The time each command took goes to standard error.
+"""
+import argparse
+import sys
+import time
+import find_paralogs as fp
+import get_fsgm_input as gfi
+import get_roary_core as grc
+import pairwise_table as pt
+import plot_rtab
+import roary_reader as rr
+import simulate_pan_genome as spg
+
+CHAIN_SEPARATOR = '+'
+
+
+class Session:
+    """
+    The roary run loaded by the load command, shared by the commands after it
+    """
+
+    def __init__(self):
+        self.roary_dir = None
+        self.gpa = None
+
+    def load(self, roary_dir, mmap=False, use_cache=True):
+        """
+        Reads the run's gene_presence_absence.csv
+        :param roary_dir: folder with the roary output
+        :param mmap: memory map the reader's cached matrix
+        :param use_cache: use (and write) the reader's cache
+        """
+        self.gpa = rr.read_gene_pres_abs(roary_dir +
+                                         '/gene_presence_absence.csv',
+                                         use_cache=use_cache, mmap=mmap)
+        self.roary_dir = roary_dir
+
+
+def run_load(session, options):
+    session.load(options.roary_dir, options.mmap, not options.no_cache)
+
+
+def run_paralogs(session, options):
+    fp.merge_paralogs(session.roary_dir, options)
+
+
+def run_core(session, options):
+    grc.write_core_lists(session.roary_dir)
+
+
+def run_pairwise(session, options):
+    if options.kernel == 'popcount':
+        poss_mat = session.gpa.presence_words()
+    else:
+        poss_mat = session.gpa.presence
+    pt.make_tables(options, poss_mat, session.gpa.strain_names,
+                   rr.get_fingerprint(session.gpa.file_path))
+
+
+def run_simulate(session, options):
+    spg.run_simulations(options, session.gpa.presence,
+                        session.gpa.strain_names)
+
+
+def run_fsgm_input(session, options):
+    gene_counts = gfi.get_gene_counts_dict(session.gpa.presence)
+    gfi.print_c_for_fsgm(gene_counts, len(session.gpa.strain_names))
+    sys.stdout.flush()
+
+
+def run_plot_rtab(session, options):
+    plot_rtab.make_all_plots(session.roary_dir, options.outdir,
+                             options.nickname, options.summary)
+
+
+def add_load_arguments(parser):
+    parser.add_argument('roary_dir', help='folder with the roary output')
+    parser.add_argument('--mmap', action='store_true',
+                        help='memory map the cached packed gene presence '
+                             'matrix instead of loading a private copy (the '
+                             'boolean matrix is still unpacked in memory)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help="don't read or write the gene presence cache")
+
+
+def add_no_arguments(parser):
+    pass
+
+
+# name, help, function adding the options, function running the command
+COMMANDS = [
+    ('load', 'read the gene presence matrix of a roary run',
+     add_load_arguments, run_load),
+    ('paralogs', 'merge the paralogs split by roary (find_paralogs.py)',
+     fp.add_arguments, run_paralogs),
+    ('core', 'write the core gene lists (get_roary_core.py)',
+     add_no_arguments, run_core),
+    ('pairwise', 'pairwise gene count tables (pairwise_table.py)',
+     pt.add_arguments, run_pairwise),
+    ('simulate', 'simulate the pan genome curves (simulate_pan_genome.py)',
+     spg.add_arguments, run_simulate),
+    ('fsgm-input', 'write the cgs_supragenome.m input to standard out '
+                   '(get_fsgm_input.py)',
+     add_no_arguments, run_fsgm_input),
+    ('plot-rtab', 'plot the pan genome curves (plot_rtab.py)',
+     plot_rtab.add_arguments, run_plot_rtab),
+]
+
+
+def get_parser():
+    """
+    :return: parser for one command of the chain
+    """
+    parser = argparse.ArgumentParser(
+        prog='roary-analysis',
+        description='Run analyses of a roary run in one process.  Chain '
+                    'commands with %s, starting with load.' % CHAIN_SEPARATOR)
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+    for name, help_text, add_arguments, run in COMMANDS:
+        subparser = subparsers.add_parser(name, help=help_text,
+                                          description=help_text)
+        add_arguments(subparser)
+        subparser.set_defaults(run=run)
+    return parser
+
+
+def split_chain(args):
+    """
+    :param args: command line arguments
+    :return: list of the arguments of each command, split on CHAIN_SEPARATOR
+    """
+    chain = [[]]
+    for arg in args:
+        if arg == CHAIN_SEPARATOR:
+            chain.append([])
+        else:
+            chain[-1].append(arg)
+    return chain
+
+
+def parse_chain(args):
+    """
+    :param args: command line arguments
+    :return: list of the parsed options of each command.  Exits with a usage
+    message if any command is invalid or a command needing the matrix comes
+    before load.
+    """
+    parser = get_parser()
+    chain = [parser.parse_args(x) for x in split_chain(args)]
+    if chain[0].command != 'load':
+        parser.error('the first command must be load, not %s' %
+                     chain[0].command)
+    return chain
+
+
+def run_chain(chain, session=None):
+    """
+    Runs each command in order, sharing one Session
+    :param chain: output of parse_chain
+    :param session: Session to start from, a new one by default
+    :return: list of (command, seconds)
+    """
+    if session is None:
+        session = Session()
+    timings = list()
+    for options in chain:
+        start = time.time()
+        options.run(session, options)
+        seconds = time.time() - start
+        sys.stderr.write('%-12s %8.1fs\n' % (options.command, seconds))
+        timings.append((options.command, seconds))
+    return timings
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    run_chain(parse_chain(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+"""
+Shared reader for roary's gene_presence_absence.csv
+The file is streamed one row at a time with the csv module, so commas inside
+the quoted annotations are handled and the file is never held in memory as
+strings.  The strain columns are stored as a uint8 gene x strain copy number
+matrix (the number of tab separated gene ids in a cell, capped at 255).  The
+presence matrix is derived from it, optionally bit packed into 64 bit words.
+The metadata columns (annotation, QC...) are only read when asked for.  How
+many there are depends on the roary version, which is found from the header
+(see META_COLUMNS), so files from newer roary versions are read in place
+without rewriting them with roary_version_fix.py.
+The first time a file is read, the matrix is saved in a hidden sidecar folder
+next to it (copy numbers, presence as packed words, cluster and strain
+names), about 1.1 bytes per gene and strain.  Later reads load the sidecar
+instead of parsing the csv, as long as the file's size, modification time
+and sampled hash still match, and each array is only read once it is used.
+The sidecar can also be memory mapped read only, so processes working on the
+same roary run share the copy numbers and packed words through the page
+cache instead of each holding a copy.  The boolean matrix is always rebuilt
+in the process that uses it.
+"""
+import collections
+import csv
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from lazy_import import LazyModule
+
+np = LazyModule('numpy')
+
+# The metadata column headings at the start of gene_presence_absence.csv for
+# each roary version that changed them, strains come after these.  A new
+# layout only needs a new entry here.
+META_COLUMNS = collections.OrderedDict([
+    ('3.2.5', ['Gene', 'Non-unique Gene name', 'Annotation', 'No. isolates',
+               'No. sequences', 'Avg sequences per isolate',
+               'Genome Fragment', 'Order within Fragment',
+               'Accessory Fragment', 'Accessory Order with Fragment', 'QC']),
+    ('3.5.1', ['Gene', 'Non-unique Gene name', 'Annotation', 'No. isolates',
+               'No. sequences', 'Avg sequences per isolate',
+               'Genome Fragment', 'Order within Fragment',
+               'Accessory Fragment', 'Accessory Order with Fragment', 'QC',
+               'Min group size nuc', 'Max group size nuc',
+               'Avg group size nuc']),
+])
+
+# Gene plus the ten roary 3.2.5 metadata columns, the fewest of any version
+NUM_META_COLS = len(META_COLUMNS['3.2.5'])
+MAX_COPY_NUM = 255
+
+# Paralog cells can be longer than the csv module's default field limit
+csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+
+
+# Input is the path to a csv file
+# Returns the file opened the way the csv module expects for this python
+def open_csv(file_path):
+    if sys.version_info[0] < 3:
+        return open(file_path, 'rb')
+    return open(file_path, 'r', newline='')
+
+
+# Input is the path to a roary style csv file
+# Yields each non empty row as a list of strings, starting with the headings
+def iter_rows(file_path):
+    with open_csv(file_path) as f:
+        for row in csv.reader(f):
+            if len(row) > 0:
+                yield row
+
+
+# Input is a row as a list of strings
+# Returns it as a line of a roary style csv file (without the newline), every
+# entry double quoted and quotes inside an entry doubled, so iter_rows reads
+# the same row back
+def format_row(row):
+    return '"' + '","'.join(x.replace('"', '""') for x in row) + '"'
+
+
+# Input is the header row of a gene_presence_absence.csv file
+# Returns the roary version in META_COLUMNS whose metadata columns the header
+# starts with, the one with the most columns if several match
+def get_version(header):
+    matches = [(len(cols), version) for version, cols in META_COLUMNS.items()
+               if header[:len(cols)] == cols]
+    if len(matches) == 0:
+        raise ValueError("header doesn't match any known roary version: %s"
+                         % ','.join(header[:NUM_META_COLS]))
+    return max(matches)[1]
+
+
+# Input is the header row of a gene_presence_absence.csv file
+# Returns the number of metadata columns, the strain columns start here
+def get_num_meta_cols(header):
+    return len(META_COLUMNS[get_version(header)])
+
+
+# Input is the contents of a strain column
+# Returns the number of copies of the gene, copies are separated by tabs
+def copy_number(cell):
+    if len(cell) == 0:
+        return 0
+    return min(cell.count('\t') + 1, MAX_COPY_NUM)
+
+
+class GenePresAbs(object):
+    """
+    Gene x strain copy numbers from a gene_presence_absence.csv style file.
+    Rows are clusters in file order and columns are strains.  Arrays and
+    columns read after the names are checked against the fingerprint the
+    file had when the names were read, so a file changed in the meantime
+    raises a ValueError instead of mixing two versions of it.
+    """
+
+    def __init__(self, file_path, cluster_names, strain_names, copy_num,
+                 header, words=None, presence=None, load_cached=None,
+                 fingerprint=None):
+        self.file_path = file_path
+        self.fingerprint = fingerprint
+        self.cluster_names = cluster_names
+        self.strain_names = strain_names
+        self.header = header
+        self.version = get_version(header)
+        self._copy_num = copy_num
+        self._presence = presence
+        self._words = words
+        # Function reading one of the sidecar's arrays (None if it can't),
+        # so a cached matrix is only loaded when it is asked for
+        self._load_cached = load_cached
+        self._metadata = dict()
+
+    @property
+    def num_genes(self):
+        return len(self.cluster_names)
+
+    @property
+    def num_strains(self):
+        return len(self.strain_names)
+
+    def _check_unchanged(self):
+        if (self.fingerprint is not None and
+                get_fingerprint(self.file_path) != self.fingerprint):
+            raise ValueError('%s changed after it was read, read it again' %
+                             self.file_path)
+
+    def _from_cache(self, name):
+        if self._load_cached is None:
+            return None
+        arr = self._load_cached(name)
+        self._check_unchanged()
+        return arr
+
+    @property
+    def copy_num(self):
+        """
+        :return: uint8 gene x strain matrix of gene copy numbers
+        """
+        if self._copy_num is None:
+            self._copy_num = self._from_cache('copy_num.npy')
+        if self._copy_num is None:
+            self._copy_num = parse_gene_pres_abs(self.file_path).copy_num
+            self._check_unchanged()
+        return self._copy_num
+
+    @property
+    def presence(self):
+        """
+        :return: boolean gene x strain matrix, True if the strain has the gene.
+        It isn't cached, it is made from the copy numbers if they are loaded
+        and otherwise unpacked from the packed words, which are 8x smaller
+        to read.
+        """
+        if self._presence is None and self._copy_num is None:
+            if self._words is None:
+                self._words = self._from_cache('presence_words.npy')
+            if self._words is not None:
+                self._presence = unpack_words(self._words, self.num_genes)
+        if self._presence is None:
+            self._presence = self.copy_num > 0
+        return self._presence
+
+    def presence_words(self):
+        """
+        :return: the presence matrix bit packed into a (strains x words)
+        uint64 matrix, see pack_words.  From the cache this doesn't make the
+        boolean matrix at all.
+        """
+        if self._words is None:
+            self._words = self._from_cache('presence_words.npy')
+        if self._words is None:
+            self._words = pack_words(self.presence)
+        return self._words
+
+    def metadata(self, column):
+        """
+        Reads one metadata column from the file the first time it is asked for
+        :param column: column heading, ex "Annotation"
+        :return: list with the column's value for each cluster
+        """
+        if column not in self._metadata:
+            index = self.header.index(column)
+            rows = iter_rows(self.file_path)
+            next(rows)
+            values = [row[index] for row in rows]
+            self._check_unchanged()
+            self._metadata[column] = values
+        return self._metadata[column]
+
+
+# Input is a gene x strain matrix bit packed along the genes with np.packbits
+# Returns the same bits as a C contiguous (strains x words) uint64 matrix,
+# each strain's bytes zero padded to a whole number of 64 bit words
+def words_from_packed(packed):
+    num_bytes, num_strains = packed.shape
+    num_words = (num_bytes + 7) // 8
+    by_strain = np.zeros((num_strains, num_words * 8), dtype=np.uint8)
+    by_strain[:, :num_bytes] = packed.T
+    return by_strain.view(np.uint64)
+
+
+# Number of genes packed (or unpacked) at a time, a multiple of 64
+PACK_GENES = 1 << 16
+
+
+# Input is a boolean gene x strain matrix
+# Returns it bit packed along the genes as a (strains x words) uint64 matrix,
+# 8x smaller than the booleans.  Counting the set bits of an AND (or XOR) of
+# two rows gives the genes two strains share (or differ by) with 64 genes per
+# operation.  The genes are packed a chunk at a time.
+def pack_words(presence):
+    num_genes, num_strains = presence.shape
+    words = np.zeros((num_strains, (num_genes + 63) // 64), dtype=np.uint64)
+    for start in range(0, num_genes, PACK_GENES):
+        chunk = words_from_packed(np.packbits(
+            presence[start:start + PACK_GENES], axis=0))
+        words[:, start // 64:start // 64 + chunk.shape[1]] = chunk
+    return words
+
+
+# Inputs are a (strains x words) matrix from pack_words and the number of
+# genes packed into it
+# Returns the boolean gene x strain matrix, unpacked a chunk at a time
+def unpack_words(words, num_genes):
+    presence = np.empty((num_genes, words.shape[0]), dtype=bool)
+    start = 0
+    for chunk in iter_unpacked(words):
+        chunk = chunk[:num_genes - start]
+        presence[start:start + len(chunk)] = chunk
+        start += len(chunk)
+    return presence
+
+
+# Input is a (strains x words) matrix from pack_words
+# Yields the booleans of each chunk of genes as a (genes x strains) matrix,
+# including the zero padding genes of the last word
+def iter_unpacked(words):
+    chunk_words = PACK_GENES // 64
+    for start in range(0, words.shape[1], chunk_words):
+        chunk = np.ascontiguousarray(words[:, start:start + chunk_words])
+        bits = np.unpackbits(chunk.view(np.uint8), axis=1)
+        yield bits.T.view(bool)
+
+
+_M1 = 0x5555555555555555
+_M2 = 0x3333333333333333
+_M4 = 0x0f0f0f0f0f0f0f0f
+_H01 = 0x0101010101010101
+
+
+# Input is a uint64 array
+# Returns the number of set bits in each element.  Uses np.bitwise_count
+# (numpy 2.0+) and otherwise the branch free SWAR bit count.
+def popcount(words):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    m1, m2, m4, h01 = [np.uint64(x) for x in (_M1, _M2, _M4, _H01)]
+    words = words - ((words >> np.uint64(1)) & m1)
+    words = (words & m2) + ((words >> np.uint64(2)) & m2)
+    words = (words + (words >> np.uint64(4))) & m4
+    return (words * h01) >> np.uint64(56)
+
+
+# Input is the path to gene_presence_absence.csv (or a file with its layout)
+# Returns a GenePresAbs built while streaming the file
+def parse_gene_pres_abs(file_path):
+    rows = iter_rows(file_path)
+    header = next(rows)
+    num_meta_cols = get_num_meta_cols(header)
+    strain_names = header[num_meta_cols:]
+    num_strains = len(strain_names)
+
+    cluster_names = list()
+    copy_nums = bytearray()
+    for row in rows:
+        cells = row[num_meta_cols:]
+        if len(cells) != num_strains:
+            raise ValueError("%s: cluster %s has %d strain columns, expected %d"
+                             % (file_path, row[0], len(cells), num_strains))
+        cluster_names.append(row[0])
+        copy_nums.extend(copy_number(x) for x in cells)
+
+    copy_num = np.frombuffer(copy_nums, dtype=np.uint8)
+    copy_num = copy_num.reshape((len(cluster_names), num_strains))
+    return GenePresAbs(file_path, cluster_names, strain_names, copy_num, header)
+
+
+# Bump when the sidecar layout changes so old caches are rebuilt
+CACHE_VERSION = 5
+# Bytes hashed from each end of the file for the fingerprint
+SAMPLE_BYTES = 1 << 20
+
+
+# Input is the path to a file
+# Returns a dict identifying the file's contents: its size, modification
+# time and a hash of its first and last megabyte
+def get_fingerprint(file_path):
+    stat = os.stat(file_path)
+    sha = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        sha.update(f.read(SAMPLE_BYTES))
+        if stat.st_size > SAMPLE_BYTES:
+            f.seek(max(SAMPLE_BYTES, stat.st_size - SAMPLE_BYTES))
+            sha.update(f.read(SAMPLE_BYTES))
+    return {'version': CACHE_VERSION, 'size': stat.st_size,
+            'mtime': stat.st_mtime, 'sha1': sha.hexdigest()}
+
+
+# Input is the path to a roary csv file
+# Returns the path of its sidecar cache folder
+def get_cache_dir(file_path):
+    folder, name = os.path.split(os.path.abspath(file_path))
+    return os.path.join(folder, '.' + name + '.cache')
+
+
+def write_names(file_name, names):
+    text = '\n'.join(names)
+    if sys.version_info[0] >= 3:
+        text = text.encode('utf-8')
+    with open(file_name, 'wb') as f:
+        f.write(text)
+
+
+def read_names(file_name):
+    with open(file_name, 'rb') as f:
+        text = f.read()
+    if sys.version_info[0] >= 3:
+        text = text.decode('utf-8')
+    if len(text) == 0:
+        return list()
+    return text.split('\n')
+
+
+# Inputs are a sidecar folder and whether to memory map its arrays
+# Returns a function reading one of the folder's .npy files, None if it
+# can't be read (ex the sidecar was rebuilt in the meantime)
+def cached_array_loader(cache_dir, mmap=False):
+    mmap_mode = 'r' if mmap else None
+
+    def load_cached(name):
+        try:
+            return np.load(os.path.join(cache_dir, name), mmap_mode=mmap_mode)
+        except (IOError, OSError, ValueError):
+            return None
+    return load_cached
+
+
+# Inputs are the path to a roary csv file, its current fingerprint and
+# whether to memory map the arrays
+# Returns the GenePresAbs saved in the file's sidecar or None if there is no
+# sidecar or it was made from a different version of the file.  Only the
+# names are read here, each array is loaded (or mapped) the first time it is
+# used, so a script that only needs the presence matrix doesn't also read
+# the copy numbers and packed words.  Memory mapped arrays are read only.
+def read_cache(file_path, fingerprint, mmap=False):
+    cache_dir = get_cache_dir(file_path)
+    try:
+        with open(os.path.join(cache_dir, 'fingerprint.json'), 'r') as f:
+            if json.load(f) != fingerprint:
+                return None
+        cluster_names = read_names(os.path.join(cache_dir, 'clusters.txt'))
+        header = read_names(os.path.join(cache_dir, 'header.txt'))
+    except (IOError, OSError, ValueError):
+        return None
+    return GenePresAbs(file_path, cluster_names,
+                       header[get_num_meta_cols(header):], None, header,
+                       load_cached=cached_array_loader(cache_dir, mmap),
+                       fingerprint=fingerprint)
+
+
+# Inputs are a GenePresAbs and the fingerprint of the file it was read from
+# Only the copy numbers and the packed words are stored, the boolean presence
+# matrix is rebuilt from the words when it is loaded.  Readers only load the
+# arrays they use.
+# Writes the sidecar into a temporary folder that is then renamed into
+# place, so readers never see a partly written cache
+def write_cache(gpa, fingerprint):
+    cache_dir = get_cache_dir(gpa.file_path)
+    folder, name = os.path.split(cache_dir)
+    tmp_dir = tempfile.mkdtemp(prefix=name + '.tmp', dir=folder)
+    try:
+        np.save(os.path.join(tmp_dir, 'copy_num.npy'), gpa.copy_num)
+        np.save(os.path.join(tmp_dir, 'presence_words.npy'),
+                gpa.presence_words())
+        write_names(os.path.join(tmp_dir, 'clusters.txt'), gpa.cluster_names)
+        write_names(os.path.join(tmp_dir, 'header.txt'), gpa.header)
+        with open(os.path.join(tmp_dir, 'fingerprint.json'), 'w') as f:
+            json.dump(fingerprint, f)
+        if os.path.isdir(cache_dir):
+            shutil.rmtree(cache_dir)
+        os.rename(tmp_dir, cache_dir)
+    finally:
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+
+
+# Inputs are the path to gene_presence_absence.csv (or a file with its
+# layout), whether to use the sidecar cache and whether to memory map it
+# Returns a GenePresAbs, from the cache when it matches the file.  Otherwise
+# the file is parsed and the cache rewritten.  A folder that can't be written
+# to just means the file is parsed every time (and nothing is memory mapped).
+def read_gene_pres_abs(file_path, use_cache=True, mmap=False):
+    if not use_cache:
+        return parse_gene_pres_abs(file_path)
+
+    fingerprint = get_fingerprint(file_path)
+    gpa = read_cache(file_path, fingerprint, mmap)
+    if gpa is not None:
+        return gpa
+
+    gpa = parse_gene_pres_abs(file_path)
+    gpa.fingerprint = fingerprint
+    try:
+        write_cache(gpa, fingerprint)
+    except (IOError, OSError):
+        return gpa
+    if mmap:
+        return read_cache(file_path, fingerprint, mmap) or gpa
+    return gpa
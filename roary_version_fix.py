@@ -6,12 +6,18 @@ Different versions of Roary format the output files differently.  Most of these
 scripts were written for roary 3.2.5 but currently the cluster is running 3.5.1.
 This program rewrites the gene_presence_absence.csv so that it has the number of
 metadata columns found in 3.2.5.
-Currently only considering 3.2.5 and 3.5.1
+The metadata columns of each known version are listed in
+roary_reader.META_COLUMNS.  The file is rewritten one row at a time into a
+temporary file that then replaces it, so memory use doesn't depend on the
+file's size and an interrupted run never leaves a partly written file.
 """
-import sys
+import argparse
 import os
-from subprocess import call
-import numpy as np
+import shutil
+import tempfile
+import roary_reader as rr
+
+TARGET_VERSION = '3.2.5'
 
 
 class GenePresAbs:
@@ -19,13 +25,6 @@ class GenePresAbs:
     Class invariant:  self.version is the roary version of the data in
     self.file_path
     """
-    header_351 = '"Gene","Non-unique Gene name","Annotation","No. isolates",' \
-                 '"No. sequences","Avg sequences per isolate","Genome Fragment",' \
-                 '"Order within Fragment","Accessory Fragment",' \
-                 '"Accessory Order with Fragment","QC","Min group size nuc",' \
-                 '"Max group size nuc","Avg group size nuc"'
-    extra_351_cols = ["Min group size nuc", "Max group size nuc",
-                      "Avg group size nuc"]
 
     def __init__(self, roary_dir):
         self.file_path = roary_dir + '/gene_presence_absence.csv'
@@ -33,46 +32,123 @@ class GenePresAbs:
 
         self.original_path = self.file_path.replace('.csv', '_original.csv')
         if not os.path.isfile(self.original_path):
-            call(['cp', self.file_path, self.original_path])
+            atomic_copy(self.file_path, self.original_path)
 
         self.version = self.get_version(self.original_path)
 
     @staticmethod
     def get_version(file_path):
-        with open(file_path, 'r') as f:
-            header = f.readline()
-            if header.startswith(GenePresAbs.header_351):
-                return '3.5.1'
-            else:
-                return '3.2.5'
-
-    def get_data_325(self):
-        data351 = np.genfromtxt(self.original_path, delimiter='","',
-                                dtype=str)
-        indices = get_column_indices(data351, col_headings=self.extra_351_cols)
-        return np.delete(data351, indices, axis=1)
-
-    def write_325(self):
-        if self.version == '3.2.5':
+        """
+        :param file_path: path to a gene_presence_absence.csv file
+        :return: the roary version its header matches
+        """
+        return rr.get_version(next(rr.iter_rows(file_path)))
+
+    def get_data(self, version):
+        """
+        :param version: roary version in rr.META_COLUMNS to convert to
+        :return: generator over the rows of the original file with the
+        metadata columns of version followed by the strain columns
+        """
+        rows = rr.iter_rows(self.original_path)
+        header = next(rows)
+        indices = get_kept_indices(header, self.version, version)
+        yield [header[i] for i in indices]
+        for row in rows:
+            yield [row[i] for i in indices]
+
+    def write(self, version=TARGET_VERSION):
+        """
+        Rewrites self.file_path in the layout of version
+        :param version: roary version in rr.META_COLUMNS
+        """
+        if self.version == version:
             return
-        data_325 = self.get_data_325()
-        data_325 = '\n'.join('","'.join(x) for x in data_325)
-        with open(self.file_path, 'w') as f:
-            f.write(data_325)
-            f.write('\n')
-        self.version = '3.2.5'
+        folder = os.path.dirname(os.path.abspath(self.file_path))
+        fd, tmp_path = tempfile.mkstemp(suffix='.csv.tmp', dir=folder)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                for row in self.get_data(version):
+                    f.write(rr.format_row(row) + '\n')
+            shutil.copymode(self.file_path, tmp_path)
+            os.replace(tmp_path, self.file_path)
+        finally:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+        self.version = version
+
+
+def get_kept_indices(header, from_version, to_version):
+    """
+    :param header: header row of a file in the from_version layout
+    :param from_version: roary version of the file
+    :param to_version: roary version to convert to
+    :return: indices of the columns to keep, the metadata columns of
+    to_version followed by every strain column
+    """
+    from_cols = rr.META_COLUMNS[from_version]
+    to_cols = rr.META_COLUMNS[to_version]
+    missing = [x for x in to_cols if x not in from_cols]
+    if len(missing) > 0:
+        raise ValueError('roary %s files have no %s columns for %s' %
+                         (from_version, ', '.join(missing), to_version))
+    indices = [header.index(heading) for heading in to_cols]
+    return indices + list(range(len(from_cols), len(header)))
+
+
+def atomic_copy(src, dst):
+    """
+    Copies src to dst through a temporary file so dst is complete or absent
+    :param src: file to copy
+    :param dst: path of the copy
+    """
+    folder = os.path.dirname(os.path.abspath(dst))
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=folder)
+    os.close(fd)
+    try:
+        shutil.copy2(src, tmp_path)
+        os.replace(tmp_path, dst)
+    finally:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+
+
+def get_options():
+    parser = argparse.ArgumentParser(
+        description='Rewrite gene_presence_absence.csv with the metadata '
+                    'columns of roary ' + TARGET_VERSION)
+    parser.add_argument('roary_dir',
+                        help='folder with the roary output, the original csv '
+                             'is kept as gene_presence_absence_original.csv')
+    return parser.parse_args()
 
 
-def get_column_indices(mat, col_headings):
-    positions = [np.where(mat[0, :] == heading) for heading in col_headings]
-    return [x[0][0] for x in positions]
+def tests1():
+    # Annotations with commas and quotes survive the rewrite
+    header = rr.META_COLUMNS['3.5.1'] + ['strain_a']
+    row = ['group_1', '', 'hypothetical, protein "x"', '1', '1', '1', '1',
+           '1', '', '', '', '100', '200', '150', 'a_00001']
+    folder = tempfile.mkdtemp()
+    try:
+        with open(folder + '/gene_presence_absence.csv', 'w') as f:
+            for line in [header, row]:
+                f.write(rr.format_row(line) + '\n')
+        gpa = GenePresAbs(folder)
+        gpa.write(TARGET_VERSION)
+        kept = get_kept_indices(header, '3.5.1', TARGET_VERSION)
+        assert(list(rr.iter_rows(gpa.file_path)) ==
+               [[header[i] for i in kept], [row[i] for i in kept]])
+    finally:
+        shutil.rmtree(folder)
+    print('tests pass')
 
 
 def main():
-    roary_outdir = sys.argv[1]
-    gpa = GenePresAbs(roary_outdir)
-    if not gpa.version == '3.2.5':
-        gpa.write_325()
+    options = get_options()
+    tests1()
+    gpa = GenePresAbs(options.roary_dir)
+    if not gpa.version == TARGET_VERSION:
+        gpa.write(TARGET_VERSION)
 
 if __name__ == "__main__":
     main()
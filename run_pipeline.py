@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Author:  Rachel Ehrlich
+Runs the analyze_blastp_raory.sh analysis as a graph of stages.  Each stage
+declares the files it reads and writes, and the stages that write a stage's
+inputs must finish before it starts.  Stages whose outputs are all newer than
+their inputs are skipped, and independent stages (ex the simulations and the
+pairwise tables) run at the same time with --jobs.  Each stage's output goes
+to a log file in the output directory and the time each stage took is written
+to nickname_pipeline_timings.tsv.
+python3 run_pipeline.py roary_dir outdir nickname --jobs 4
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# command is a list of arguments to run in SCRIPT_DIR or a python function
+# taking the stage's log file.  stdout is a file for the command's standard
+# output, None sends it to the log.
+Stage = namedtuple('Stage', ['name', 'command', 'inputs', 'outputs', 'stdout'])
+
+ROARY_RTABS = ['number_of_conserved_genes.Rtab',
+               'number_of_genes_in_pan_genome.Rtab',
+               'number_of_new_genes.Rtab', 'number_of_unique_genes.Rtab']
+PAIRWISE_TABLES = ['similarity', 'difference', 'pair_unique']
+
+
+def copy_stage(name, src, dst):
+    """
+    :param name: stage name
+    :param src: file to copy
+    :param dst: path of the copy
+    :return: a Stage copying src to dst.  The copy gets a new modification time
+    so it is newer than its input.
+    """
+    def command(log):
+        shutil.copyfile(src, dst)
+    return Stage(name, command, [src], [dst], None)
+
+
+def fsgm_stage(options, counts_file, outputs):
+    """
+    :param options: the command line options
+    :param counts_file: file with the get_fsgm_input.py output
+    :param outputs: files cgs_supragenome writes
+    :return: a Stage running cgs_supragenome in matlab on the gene counts
+    """
+    def command(log):
+        with open(counts_file, 'r') as f:
+            gene_counts = f.read().strip()
+        matlab_cmd = "cgs_supragenome '%s' '%s' '%s';exit" % (
+            options.nickname, gene_counts, options.outdir)
+        subprocess.check_call(['matlab', '-nodesktop', '-nojvm', '-nosplash',
+                               '-r', matlab_cmd], cwd=options.fsgm,
+                              stdout=log, stderr=subprocess.STDOUT)
+    return Stage('fsgm', command, [counts_file], outputs, None)
+
+
+def get_stages(options):
+    """
+    :param options: the command line options
+    :return: list of the Stages in the analysis
+    """
+    roary = options.roary_output
+    prefix = os.path.join(options.outdir, options.nickname)
+    name = options.nickname
+    gpa = os.path.join(roary, 'gene_presence_absence.csv')
+    tree = os.path.join(roary, 'core_gene_alignment.aln.newick')
+    python3 = sys.executable
+    python2 = options.python
+
+    sim_rtabs = [prefix + '_' + str(float(x)) + '.Rtab'
+                 for x in options.cutoffs.split(',')]
+    pairwise = [prefix + '_pairwise_' + x + '_table.txt'
+                for x in PAIRWISE_TABLES]
+
+    stages = [
+        Stage('gene_counts_heat_map',
+              ['Rscript', 'gene_counts_heat_map.r', roary, name,
+               options.outdir],
+              [gpa],
+              [prefix + '_duplicated_genes.csv', prefix + '_cluster_counts.csv',
+               prefix + '_heatmap_gene_presence_absence.png',
+               prefix + '_heatmap_zero_one_multiple.png'], None),
+        # So the data isn't lost when unsplitting paralogs
+        copy_stage('copy_summary',
+                   os.path.join(roary, 'summary_statistics.txt'),
+                   prefix + '_roary_summary_statistics.txt'),
+        copy_stage('copy_presence_absence', gpa,
+                   prefix + '_cluster_presence_absence.csv'),
+        Stage('simulate_pan_genome',
+              [python3, 'simulate_pan_genome.py', roary, options.outdir, name,
+               options.cutoffs, str(options.num_simulations)],
+              [gpa], sim_rtabs, None),
+        Stage('plot_rtab',
+              [python2, 'plot_rtab.py', roary, options.outdir, name],
+              [os.path.join(roary, x) for x in ROARY_RTABS] + sim_rtabs,
+              [prefix + '_observed_genome_size.pdf',
+               prefix + '_observed_gene_frequencies.pdf'], None),
+        Stage('pairwise_table',
+              [python2, 'pairwise_table.py', roary, options.outdir, name],
+              [gpa],
+              [prefix + '_pairwise_table.txt',
+               prefix + '_pairwise_table_stats.txt'] + pairwise, None),
+        Stage('pairwise_heat_map',
+              ['Rscript', 'pairwise_heat_map.r', options.outdir + '/', name,
+               tree],
+              pairwise + [tree],
+              [prefix + '_pairwise_' + x + '_heatmap.pdf'
+               for x in PAIRWISE_TABLES], None),
+        Stage('draw_tree',
+              ['Rscript', 'draw_simple_tree.r', options.outdir, tree],
+              [tree], [os.path.join(options.outdir, 'tree.jpg')], None),
+    ]
+
+    if options.fsgm is not None:
+        counts_file = prefix + '_fsgm_input.txt'
+        fsgm_files = [os.path.join(options.outdir, x + name + '.txt')
+                      for x in ['N_vs_likelihood_', 'CommandWindow_']]
+        stages += [
+            Stage('get_fsgm_input',
+                  [python2, 'get_fsgm_input.py', roary],
+                  [gpa], [counts_file], counts_file),
+            fsgm_stage(options, counts_file, fsgm_files),
+            Stage('plot_fsgm_results',
+                  [python2, 'plot_fsgm_results.py', options.outdir, name],
+                  fsgm_files,
+                  [prefix + '_genes_in_pan_genome.pdf',
+                   prefix + '_new_genes_per_sequenced_genome.pdf'], None),
+        ]
+    return stages
+
+
+def get_dependencies(stages):
+    """
+    :param stages: list of Stages, no two writing the same file
+    :return: dict of stage name to the set of names of the stages that write
+    its inputs
+    """
+    producers = dict()
+    for stage in stages:
+        for out_file in stage.outputs:
+            if out_file in producers:
+                raise ValueError('%s is written by both %s and %s' %
+                                 (out_file, producers[out_file], stage.name))
+            producers[out_file] = stage.name
+    return {stage.name: set(producers[x] for x in stage.inputs
+                            if x in producers)
+            for stage in stages}
+
+
+def is_up_to_date(stage):
+    """
+    :param stage: a Stage
+    :return: True if all the stage's outputs exist and are newer than all
+    its inputs
+    """
+    if not all(os.path.exists(x) for x in stage.outputs):
+        return False
+    if not all(os.path.exists(x) for x in stage.inputs):
+        return False
+    oldest_output = min(os.path.getmtime(x) for x in stage.outputs)
+    newest_input = max([os.path.getmtime(x) for x in stage.inputs] + [0])
+    return oldest_output >= newest_input
+
+
+def get_stage_env():
+    """
+    :return: environment for the stages, plots are drawn without a display
+    unless MPLBACKEND is already set
+    """
+    env = dict(os.environ)
+    env.setdefault('MPLBACKEND', 'Agg')
+    return env
+
+
+def run_stage(stage, log_file):
+    """
+    Runs one stage with its output going to log_file
+    :param stage: a Stage
+    :param log_file: path of the stage's log
+    :return: the number of seconds the stage took
+    """
+    start = time.time()
+    env = get_stage_env()
+    with open(log_file, 'w') as log:
+        if callable(stage.command):
+            stage.command(log)
+        elif stage.stdout is not None:
+            with open(stage.stdout, 'w') as out:
+                subprocess.check_call(stage.command, cwd=SCRIPT_DIR,
+                                      stdout=out, stderr=log, env=env)
+        else:
+            subprocess.check_call(stage.command, cwd=SCRIPT_DIR, stdout=log,
+                                  stderr=subprocess.STDOUT, env=env)
+    return time.time() - start
+
+
+def run_pipeline(stages, log_prefix, jobs=1, force=False, dry_run=False):
+    """
+    Runs the stages that are out of date, each as soon as the stages it
+    depends on have finished.  A stage that depends on a stage that ran is
+    always run.  The stages that depend on a failed stage are not run, nor
+    are stages that can never start because their dependencies form a cycle
+    (ex a stage listing its own output as an input); they are all blocked.
+    Any exception from a stage counts as that stage failing.
+    :param stages: list of Stages
+    :param log_prefix: each stage logs to log_prefix + stage name + '.log'
+    :param jobs: number of stages to run at the same time
+    :param force: run every stage even if its outputs are up to date
+    :param dry_run: report what would run without running anything
+    :return: list of (stage name, status, seconds) in the order the stages
+    finished
+    """
+    dependencies = get_dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    pending = [stage.name for stage in stages]
+    status = dict()
+    results = []
+
+    def finish(name, state, seconds=0.0):
+        status[name] = state
+        results.append((name, state, seconds))
+        sys.stderr.write('%-22s %-9s %8.1fs\n' % (name, state, seconds))
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        running = dict()
+        while pending or running:
+            started = False
+            for name in list(pending):
+                deps = dependencies[name]
+                if any(status.get(x) in ('failed', 'blocked') for x in deps):
+                    pending.remove(name)
+                    finish(name, 'blocked')
+                    started = True
+                elif all(x in status for x in deps):
+                    pending.remove(name)
+                    started = True
+                    stage = by_name[name]
+                    upstream_ran = any(status[x] in ('ran', 'would run')
+                                       for x in deps)
+                    if not force and not upstream_ran and is_up_to_date(stage):
+                        finish(name, 'skipped')
+                    elif dry_run:
+                        finish(name, 'would run')
+                    else:
+                        future = executor.submit(run_stage, stage,
+                                                 log_prefix + name + '.log')
+                        running[future] = name
+            if not running:
+                # Nothing running and nothing could start, so what is left
+                # waits on a cycle and never would
+                if not started:
+                    sys.stderr.write('blocked by a dependency cycle: %s\n' %
+                                     ', '.join(pending))
+                    for name in list(pending):
+                        pending.remove(name)
+                        finish(name, 'blocked')
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    finish(name, 'ran', future.result())
+                except Exception as e:
+                    sys.stderr.write('%s failed: %s\n' % (name, e))
+                    finish(name, 'failed')
+    return results
+
+
+def write_timings(results, out_file):
+    """
+    Writes a tab separated table of each stage's status and run time
+    :param results: output of run_pipeline
+    :param out_file: path of the table
+    """
+    with open(out_file, 'w') as f:
+        f.write('stage\tstatus\tseconds\n')
+        for name, state, seconds in results:
+            f.write('%s\t%s\t%.3f\n' % (name, state, seconds))
+
+
+def get_options():
+    parser = argparse.ArgumentParser(
+        description='Run the roary analysis, skipping up to date stages')
+    parser.add_argument('roary_output', help='folder with the roary output')
+    parser.add_argument('outdir', help='folder for the results')
+    parser.add_argument('nickname', help='prefix for the output files')
+    parser.add_argument('--cutoffs', default='0.15,0.95,0.99,1.0',
+                        help='simulate_pan_genome.py cutoffs')
+    parser.add_argument('--num-simulations', type=int, default=5,
+                        help='number of simulate_pan_genome.py simulations')
+    parser.add_argument('--fsgm', default=None,
+                        help='folder with the fsgm .m files, also runs '
+                             'cgs_supragenome and plot_fsgm_results.py')
+    parser.add_argument('--python', default='python',
+                        help='python used for the python 2 scripts')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of stages to run at the same time')
+    parser.add_argument('--force', action='store_true',
+                        help='run every stage even if it is up to date')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='list the stages that would run')
+    options = parser.parse_args()
+    options.outdir = os.path.abspath(options.outdir)
+    options.roary_output = os.path.abspath(options.roary_output)
+    if options.fsgm is not None:
+        options.fsgm = os.path.abspath(options.fsgm)
+    return options
+
+
+def main():
+    options = get_options()
+    if not os.path.isdir(options.outdir):
+        os.makedirs(options.outdir)
+    prefix = os.path.join(options.outdir, options.nickname)
+
+    results = run_pipeline(get_stages(options), prefix + '_log_', options.jobs,
+                           options.force, options.dry_run)
+    if not options.dry_run:
+        write_timings(results, prefix + '_pipeline_timings.tsv')
+    if any(state in ('failed', 'blocked') for name, state, seconds in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
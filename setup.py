@@ -0,0 +1,24 @@
+from setuptools import setup
+
+setup(
+    name='roary_analysis',
+    version='0.1.0',
+    description='Scripts for analyzing the output of Roary',
+    author='Rachel Ehrlich',
+    license='GPLv2',
+    python_requires='>=3.5',
+    py_modules=['find_paralogs', 'get_fsgm_input', 'get_roary_core',
+                'lazy_import', 'pairwise_outliers', 'pairwise_table',
+                'plot_batch', 'plot_blastp_comparison', 'plot_fsgm_results',
+                'plot_rtab', 'roary_analysis', 'roary_reader',
+                'roary_version_fix', 'simulate_pan_genome', 'tree_heatmap',
+                'tree_reader'],
+    install_requires=['numpy>=1.17'],
+    extras_require={
+        'plots': ['matplotlib', 'seaborn', 'biopython'],
+        'outliers': ['matplotlib', 'pandas'],
+    },
+    entry_points={
+        'console_scripts': ['roary-analysis = roary_analysis:main'],
+    },
+)
@@ -1,4 +1,4 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
 
 # Author:  Rachel Ehrlich
 # This program takes as input a folder with roary output, an output directory
@@ -13,72 +13,287 @@
 # is next smallest cutoff <= freqnecy < cutoff.  For the case of the 
 # lowest cutoff, the lower number is 0.  For the case of 1.0, the upper 
 # range is <= to include 100%.
+# --seed makes the simulations reproducible and --jobs runs them in several
+# processes, each simulation has its own random stream so the output is the
+# same for any number of jobs.  Rows are written as simulations finish.
+# --summary replaces the .Rtab files with nickname_cutoff_summary.tsv files
+# holding the mean, standard deviation and quantiles of each column.
 
 from __future__ import division    
-import numpy as np
 import pairwise_table as pt
-import sys
-
-
-# Input is a boolean gene possession matrix
-# Output is an array of gene frequencies
-def get_gene_freq(poss_mat):
-    gene_counts = np.sum(poss_mat, 1)
-    num_strains = len(poss_mat[0,:])
-    freq = gene_counts / num_strains
-    return freq
-
-# Input is a gene frequencies array amd a sorted list of cutoff frequencies
-# Outputs a list of counts of genes whose frequencies are less than each cutoff
-# but not the previous.
-def get_counts_per_bin(freq, cutoffs):
-    counts = []
-    for val in cutoffs: 
-        counts.append((freq < val).sum())
-        
-    bins = []
-    for index, val in enumerate(counts):
-        if index > 0:
-            val -= counts[index - 1]
-        bins.append(val)
+import argparse
+import multiprocessing
+from lazy_import import LazyModule
+
+np = LazyModule('numpy')
+
+
+# Number of strains whose prefixes are binned together in one numpy call
+STRAIN_CHUNK = 64
+
+
+# Inputs are the total number of strains and a sorted list of cutoff
+# frequencies
+# Returns a tot_strains x num_cutoffs array whose [n - 1, i] entry is how many
+# gene counts c in 0..n have a frequency c / n less than cutoffs[i]
+def get_count_thresholds(tot_strains, cutoffs):
+    thresholds = np.empty((tot_strains, len(cutoffs)), dtype=int)
+    for num_strains in range(1, tot_strains + 1):
+        freqs = np.arange(num_strains + 1) / num_strains
+        thresholds[num_strains - 1] = np.searchsorted(freqs, cutoffs,
+                                                      side='left')
+    return thresholds
+
+
+# Inputs are a boolean gene possession matrix, the order the strains are
+# sampled in and the thresholds from get_count_thresholds
+# Returns a num_cutoffs x tot_strains array whose [i, n - 1] entry is the
+# number of genes in the first n strains whose frequency is less than
+# cutoff i but not the previous cutoff.  Genes not yet seen are not counted.
+# The running gene counts for a chunk of prefixes come from one cumsum and
+# their histograms from one bincount, so each simulation is O(genes * strains)
+def simulate_order(poss_mat, order, thresholds):
+    num_genes, tot_strains = poss_mat.shape
+    num_cutoffs = thresholds.shape[1]
+    bins = np.empty((num_cutoffs, tot_strains), dtype=int)
+    gene_counts = np.zeros((num_genes, 1), dtype=np.int32)
+
+    for start in range(0, tot_strains, STRAIN_CHUNK):
+        cols = order[start:start + STRAIN_CHUNK]
+        num_prefixes = len(cols)
+        prefix_counts = gene_counts + np.cumsum(poss_mat[:, cols], axis=1,
+                                                dtype=np.int32)
+        gene_counts = prefix_counts[:, -1:]
+
+        # One histogram of gene counts per prefix
+        offsets = np.arange(num_prefixes) * (tot_strains + 1)
+        hist = np.bincount((prefix_counts + offsets).ravel(),
+                           minlength=num_prefixes * (tot_strains + 1))
+        hist = hist.reshape((num_prefixes, tot_strains + 1))
+
+        # num_below[p, t] is the number of genes with count < t in prefix p
+        num_below = np.zeros((num_prefixes, tot_strains + 2), dtype=int)
+        np.cumsum(hist, axis=1, out=num_below[:, 1:])
+
+        prefixes = np.arange(num_prefixes)[:, np.newaxis]
+        prefix_thresholds = thresholds[start:start + num_prefixes]
+        nonzero_below = (num_below[prefixes, prefix_thresholds] -
+                         num_below[:, 1:2])
+        nonzero_below = np.hstack((np.zeros((num_prefixes, 1), dtype=int),
+                                   nonzero_below))
+        bins[:, start:start + num_prefixes] = np.diff(nonzero_below, axis=1).T
     return bins
 
+
+# Inputs are the seed (None for fresh entropy) and the number of simulations
+# Returns one independent SeedSequence per simulation.  Simulation i always
+# gets child i, so results don't depend on how simulations are scheduled.
+def get_simulation_seeds(seed, num_iter):
+    return np.random.SeedSequence(seed).spawn(num_iter)
+
+
+# Inputs are a gene possession matrix, the count thresholds and the
+# SeedSequence for one simulation
+# Returns the bins from simulate_order for a random strain order
+def run_simulation(poss_mat, thresholds, seed_seq):
+    rng = np.random.default_rng(seed_seq)
+    order = rng.permutation(poss_mat.shape[1])
+    return simulate_order(poss_mat, order, thresholds)
+
+
+# Set in each worker process by init_worker, the gene possession matrix is a
+# view of shared memory
+_worker_data = dict()
+
+
+def init_worker(source, thresholds):
+    _worker_data.update(poss_mat=pt.attach_array(source),
+                        thresholds=thresholds)
+
+
+def simulate_seed(seed_seq):
+    return run_simulation(_worker_data['poss_mat'],
+                          _worker_data['thresholds'], seed_seq)
+
+
+# Inputs are a gene possession matrix, a sorted list of cutoff frequencies,
+# the number of simulations, the seed and the number of processes
+# Yields the bins from simulate_order for each simulation in order
+def iter_simulations(poss_mat, cutoffs, num_iter, seed=None, jobs=1):
+    thresholds = get_count_thresholds(poss_mat.shape[1], cutoffs)
+    seeds = get_simulation_seeds(seed, num_iter)
+    if jobs <= 1:
+        for seed_seq in seeds:
+            yield run_simulation(poss_mat, thresholds, seed_seq)
+        return
+
+    pool = multiprocessing.Pool(jobs, initializer=init_worker,
+                                initargs=(pt.share_array(poss_mat),
+                                          thresholds))
+    try:
+        for bins in pool.imap(simulate_seed, seeds):
+            yield bins
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
 # Inputs are a gene possession matrix, an array of column headings,
-# a list of cutoff frequencies and the number of simulations
+# a list of cutoff frequencies, the number of simulations, the seed and
+# the number of processes
 # Returns a list of matrices where each matrix is the gene counts
 # for each frequency bin for all simulations
-def simulate_reordering(poss_mat, col_headings, cutoffs, num_iter):
+def simulate_reordering(poss_mat, col_headings, cutoffs, num_iter, seed=None,
+                        jobs=1):
     tot_strains = len(col_headings)
     
     # pre allocate array
     results = [np.empty((num_iter, tot_strains), dtype=int) for x in cutoffs]
 
     # Each iteration is one simulation
-    for x in xrange(num_iter):
-        
-        # pre allocate array
-        temp_results = [np.empty((tot_strains), dtype=int) for z in cutoffs]
-        
-        # reorder the strains
-        order = np.random.permutation(range(tot_strains))
-        poss_mat = poss_mat[:, order]
-        
-        # simulate adding one strain at a time
-        for num_strains in xrange(1, tot_strains + 1):
-
-            freq = get_gene_freq(poss_mat[:, :num_strains])
-            nonzero_freq = freq[np.nonzero(freq)]
-            counts_per_bin = get_counts_per_bin(nonzero_freq, cutoffs)
+    simulations = iter_simulations(poss_mat, cutoffs, num_iter, seed, jobs)
+    for x, bins in enumerate(simulations):
+        for i in range(len(cutoffs)):
+            results[i][x, :] = bins[i]
             
-            assert(len(nonzero_freq) == sum(counts_per_bin))
+    return results
 
-            for i in xrange(len(cutoffs)):
-                temp_results[i][num_strains - 1] = int(counts_per_bin[i])
 
-        for i in xrange(len(cutoffs)):
-            results[i][x,:] = temp_results[i]
-            
-    return results
+class P2Quantile(object):
+    """
+    Streaming estimate of one quantile for every position of a vector using
+    the P-square algorithm (Jain and Chlamtac 1985).  Five markers are kept
+    per position, so memory doesn't grow with the number of observations.
+    """
+
+    def __init__(self, prob, size):
+        self.prob = prob
+        self.count = 0
+        self.heights = np.zeros((size, 5))
+        self.positions = np.tile(np.arange(1.0, 6.0), (size, 1))
+        self.desired = np.array([1.0, 1 + 2 * prob, 1 + 4 * prob,
+                                 3 + 2 * prob, 5.0])
+        self.increments = np.array([0.0, prob / 2, prob, (1 + prob) / 2, 1.0])
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        heights = self.heights
+        positions = self.positions
+        if self.count < 5:
+            heights[:, self.count] = values
+            self.count += 1
+            if self.count == 5:
+                heights.sort(axis=1)
+            return
+        self.count += 1
+
+        # Find the cell holding each value, extending the end markers
+        heights[:, 0] = np.minimum(heights[:, 0], values)
+        heights[:, 4] = np.maximum(heights[:, 4], values)
+        cell = np.sum(values[:, np.newaxis] >= heights[:, 1:4], axis=1)
+        positions += np.arange(5) > cell[:, np.newaxis]
+        self.desired += self.increments
+
+        # Move the middle markers that are off their desired positions
+        for i in (1, 2, 3):
+            offset = self.desired[i] - positions[:, i]
+            step = (((offset >= 1) &
+                     (positions[:, i + 1] - positions[:, i] > 1)).astype(float)
+                    - ((offset <= -1) &
+                       (positions[:, i - 1] - positions[:, i] < -1)))
+            move = step != 0
+            if not move.any():
+                continue
+            d = step[move]
+            q = heights[move]
+            n = positions[move]
+            parabolic = q[:, i] + d / (n[:, i + 1] - n[:, i - 1]) * (
+                (n[:, i] - n[:, i - 1] + d) * (q[:, i + 1] - q[:, i]) /
+                (n[:, i + 1] - n[:, i]) +
+                (n[:, i + 1] - n[:, i] - d) * (q[:, i] - q[:, i - 1]) /
+                (n[:, i] - n[:, i - 1]))
+            rows = np.arange(len(d))
+            neighbor = np.where(d > 0, i + 1, i - 1)
+            linear = q[:, i] + d * (q[rows, neighbor] - q[:, i]) / (
+                n[rows, neighbor] - n[:, i])
+            in_bounds = (q[:, i - 1] < parabolic) & (parabolic < q[:, i + 1])
+            heights[move, i] = np.where(in_bounds, parabolic, linear)
+            positions[move, i] += d
+
+    def estimate(self):
+        # Until the markers start moving they are the observations themselves
+        if self.count <= 5:
+            return np.percentile(self.heights[:, :self.count],
+                                 self.prob * 100, axis=1)
+        return self.heights[:, 2].copy()
+
+
+class SimulationSummary(object):
+    """
+    Running mean, standard deviation and approximate quantiles of the gene
+    counts for each number of strains sampled, across simulations.
+    """
+
+    def __init__(self, size, quantiles):
+        self.count = 0
+        self.mean = np.zeros(size)
+        self.sum_sq = np.zeros(size)
+        self.quantiles = [P2Quantile(x, size) for x in quantiles]
+
+    # Input is one simulation's counts for this cutoff
+    # Updates the statistics with Welford's method
+    def add(self, values):
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self.sum_sq += delta * (values - self.mean)
+        for quantile in self.quantiles:
+            quantile.add(values)
+
+    def std(self):
+        if self.count < 2:
+            return np.zeros(len(self.mean))
+        return np.sqrt(self.sum_sq / (self.count - 1))
+
+    # Writes one tab separated row per statistic, the columns are the
+    # number of strains sampled
+    def write(self, file_name):
+        rows = [['statistic'] + list(range(1, len(self.mean) + 1)),
+                ['mean'] + list(self.mean), ['sd'] + list(self.std())]
+        for quantile in self.quantiles:
+            rows.append(['q' + str(quantile.prob)] + list(quantile.estimate()))
+        txt = '\n'.join('\t'.join(map(str, x)) for x in rows)
+        pt.write_output(txt, file_name)
+
+
+def tests1():
+    rs = np.random.RandomState(0)
+    data = np.column_stack([rs.normal(50, 10, 2000), rs.uniform(0, 100, 2000),
+                            rs.randint(0, 200, 2000), rs.exponential(20, 2000)])
+    # P-square is approximate, allow 1% of each column's range
+    tolerance = 0.01 * (data.max(axis=0) - data.min(axis=0))
+
+    summary = SimulationSummary(data.shape[1], [0.05, 0.5, 0.95])
+    for row in data:
+        summary.add(row)
+    assert(summary.count == len(data))
+    assert(np.allclose(summary.mean, np.mean(data, axis=0)))
+    assert(np.allclose(summary.std(), np.std(data, axis=0, ddof=1)))
+    for quantile in summary.quantiles:
+        expected = np.percentile(data, quantile.prob * 100, axis=0)
+        assert(np.all(np.abs(quantile.estimate() - expected) <= tolerance))
+
+    # With five or fewer observations the estimate is exact
+    quantile = P2Quantile(0.5, data.shape[1])
+    for row in data[:3]:
+        quantile.add(row)
+    assert(np.allclose(quantile.estimate(), np.median(data[:3], axis=0)))
+    assert(np.all(SimulationSummary(2, []).std() == 0))
+    print('tests pass')
+
 
 # Input is a list of lists and an output file name
 # connects each list with tabs and the list of list with newlines
@@ -88,24 +303,89 @@ def make_rtab(data, file_name):
     pt.write_output(txt, file_name)
 
 
-def main():   
-    in_folder = sys.argv[1]
-    out_dir = sys.argv[2]
-    nickname = sys.argv[3]
-    cutoffs = sys.argv[4]
-    num_iter = int(sys.argv[5])
-    
-    cutoffs = [float(x) for x in cutoffs.split(',')]
+# Inputs are an iterable of simulation bins and one output file per cutoff
+# Writes each simulation's row to the cutoff's .Rtab as soon as it finishes
+def write_rtabs(simulations, file_names):
+    files = [open(x, 'w') for x in file_names]
+    try:
+        for x, bins in enumerate(simulations):
+            for rtab, row in zip(files, bins):
+                if x > 0:
+                    rtab.write('\n')
+                rtab.write('\t'.join(map(str, row)))
+    finally:
+        for rtab in files:
+            rtab.close()
+
+
+# Input is an argparse parser
+# Adds the options for simulating from a loaded matrix, shared with
+# roary_analysis.py
+def add_arguments(parser):
+    parser.add_argument('out_dir', help='folder for the .Rtab files')
+    parser.add_argument('nickname', help='prefix for the output files')
+    parser.add_argument('cutoffs', help='comma separated cutoff frequencies, '
+                                        'ex 0.15,0.95,0.99,1.0')
+    parser.add_argument('num_iter', type=int, help='number of simulations')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed for reproducible simulations.  The output '
+                             'is the same for any number of jobs.')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of processes to run simulations in')
+    parser.add_argument('--summary', action='store_true',
+                        help='write the mean, standard deviation and '
+                             'quantiles of the simulations for each cutoff '
+                             'instead of one row per simulation')
+    parser.add_argument('--quantiles', default='0.05,0.5,0.95',
+                        help='comma separated quantiles for --summary')
+
+
+def get_options():
+    parser = argparse.ArgumentParser(
+        description='Simulate sequencing the strains of a roary run in '
+                    'random orders')
+    parser.add_argument('in_folder', help='folder with the roary output')
+    add_arguments(parser)
+    parser.add_argument('--mmap', action='store_true',
+                        help='memory map the cached packed gene presence '
+                             'matrix instead of loading a private copy (the '
+                             'boolean matrix is still unpacked in memory)')
+    return parser.parse_args()
+
+
+# Inputs are the add_arguments options, the gene presence matrix and the
+# strain names
+# Runs the simulations and writes the .Rtab (or --summary) files
+def run_simulations(options, poss_mat, col_headings):
+    cutoffs = [float(x) for x in options.cutoffs.split(',')]
     cutoffs = sorted([1.01 if x == 1 else x for x in cutoffs])
 
-    poss_mat, col_headings = pt.get_pres_abs_mat(in_folder)
-    results = simulate_reordering(poss_mat, col_headings, cutoffs, num_iter)
+    simulations = iter_simulations(poss_mat, cutoffs, options.num_iter,
+                                   options.seed, options.jobs)
     
     cutoffs = [min(x, 1.0) for x in cutoffs]
 
-    for result, cutoff in zip(results, cutoffs):
-        file_name = out_dir + '/' + nickname + '_' + str(cutoff) + '.Rtab'
-        make_rtab(result, file_name)
+    prefix = options.out_dir + '/' + options.nickname + '_'
+    if options.summary:
+        quantiles = [float(x) for x in options.quantiles.split(',')]
+        summaries = [SimulationSummary(len(col_headings), quantiles)
+                     for cutoff in cutoffs]
+        for bins in simulations:
+            for summary, row in zip(summaries, bins):
+                summary.add(row)
+        for summary, cutoff in zip(summaries, cutoffs):
+            summary.write(prefix + str(cutoff) + '_summary.tsv')
+    else:
+        file_names = [prefix + str(cutoff) + '.Rtab' for cutoff in cutoffs]
+        write_rtabs(simulations, file_names)
+
+
+def main():
+    options = get_options()
+    poss_mat, col_headings = pt.get_pres_abs_mat(options.in_folder,
+                                                 options.mmap)
+    tests1()
+    run_simulations(options, poss_mat, col_headings)
 
 
 if __name__ == "__main__":
@@ -28,12 +28,15 @@
 
 
 import argparse
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pandas as pd
-import numpy as np
-from Bio import Phylo
 import os
+import roary_reader as rr
+import tree_reader as tr
+from lazy_import import LazyModule
+
+plt = LazyModule('matplotlib.pyplot')
+sns = LazyModule('seaborn')
+np = LazyModule('numpy')
+Phylo = LazyModule('Bio.Phylo')
 
 __author__ = "Marco Galardini"
 __version__ = '0.1.0'
@@ -65,11 +68,15 @@ def get_options():
     return parser.parse_args()
 
 
+# Number of matrix cells summed at a time when binning the heat map
+BIN_CELLS = 1 << 24
+
+
 def make_freq_plot(roary, outprefix):
     # Pangenome frequency plot
     plt.figure(figsize=(7, 5))
 
-    plt.hist(roary.sum(axis=1), roary.shape[1],
+    plt.hist(np.sum(roary, axis=1), roary.shape[1],
              histtype="stepfilled", alpha=.7)
     plt.xlabel('Number of genomes')
     plt.ylabel('Number of genes')
@@ -81,13 +88,14 @@ def make_freq_plot(roary, outprefix):
 def make_pie_chart(roary, outprefix):
     # Plot the pangenome pie chart
     plt.figure(figsize=(10, 10))
-    core = roary[(roary.sum(axis=1) >= roary.shape[1] * 0.99) & (
-        roary.sum(axis=1) <= roary.shape[1])].shape[0]
-    softcore = roary[(roary.sum(axis=1) >= roary.shape[1] * 0.95) & (
-        roary.sum(axis=1) < roary.shape[1] * 0.99)].shape[0]
-    shell = roary[(roary.sum(axis=1) >= roary.shape[1] * 0.15) & (
-        roary.sum(axis=1) < roary.shape[1] * 0.95)].shape[0]
-    cloud = roary[roary.sum(axis=1) < roary.shape[1] * 0.15].shape[0]
+    counts = np.sum(roary, axis=1)
+    core = np.count_nonzero((counts >= roary.shape[1] * 0.99) &
+                            (counts <= roary.shape[1]))
+    softcore = np.count_nonzero((counts >= roary.shape[1] * 0.95) &
+                                (counts < roary.shape[1] * 0.99))
+    shell = np.count_nonzero((counts >= roary.shape[1] * 0.15) &
+                             (counts < roary.shape[1] * 0.95))
+    cloud = np.count_nonzero(counts < roary.shape[1] * 0.15)
     total = roary.shape[0]
 
     def my_autopct(pct):
@@ -111,49 +119,78 @@ def make_pie_chart(roary, outprefix):
 
 
 def get_roary_data(options):
-    # Load roary
-    roary = pd.read_table(options.spreadsheet,
-                          sep=',',
-                          low_memory=False)
-    # Set index (group name)
-    roary.set_index('Gene', inplace=True)
-    # Drop the other info columns
-    roary.drop(list(roary.columns[:10]), axis=1, inplace=True)
-    # Transform it in a presence/absence matrix (1/0)
-    roary.replace('.{2,100}', 1, regex=True, inplace=True)
-    roary.replace(np.nan, 0, regex=True, inplace=True)
-    return roary
-
-
-def get_tree_name(options):
+    # Load roary as a boolean cluster x strain presence/absence matrix
+    gpa = rr.read_gene_pres_abs(options.spreadsheet)
+    return gpa.presence, gpa.strain_names
+
+
+def get_bin_starts(length, num_bins):
+    # First index of each of num_bins nearly equal bins covering length
+    # items, one item per bin when there are fewer items than bins
+    if length <= num_bins:
+        return np.arange(length)
+    return np.unique(np.linspace(0, length, num_bins + 1).astype(int)[:-1])
+
+
+def bin_presence(roary, cluster_order, strain_order, num_rows, num_cols):
+    # Shrinks the matrix, with its rows in cluster_order and columns in
+    # strain_order, to at most num_rows x num_cols by averaging blocks of
+    # cells.  Each output value is the fraction of present cells it covers.
+    row_starts = get_bin_starts(len(cluster_order), num_rows)
+    col_starts = get_bin_starts(len(strain_order), num_cols)
+    row_sizes = np.diff(np.append(row_starts, len(cluster_order)))
+    col_sizes = np.diff(np.append(col_starts, len(strain_order)))
+
+    binned = np.empty((len(row_starts), len(col_starts)))
+    cells_per_bin = max(1, int(row_sizes.max()) * len(strain_order))
+    bins_per_chunk = max(1, BIN_CELLS // cells_per_bin)
+    for first in range(0, len(row_starts), bins_per_chunk):
+        last = min(first + bins_per_chunk, len(row_starts))
+        start = row_starts[first]
+        end = start + int(np.sum(row_sizes[first:last]))
+        block = roary[np.ix_(cluster_order[start:end], strain_order)]
+        sums = np.add.reduceat(block, row_starts[first:last] - start, axis=0,
+                               dtype=np.int32)
+        binned[first:last] = np.add.reduceat(sums, col_starts, axis=1)
+    return binned / np.outer(row_sizes, col_sizes)
+
+
+def get_tree_name(tree_file):
     # strips path
-    if '/' in options.tree:
-        tree_name = options.tree.split('/')[-1]
+    if '/' in tree_file:
+        tree_name = tree_file.split('/')[-1]
     else:
-        tree_name = options.tree
+        tree_name = tree_file
     # tree_name = tree_name.rsplit('.', 1)[0]
     return tree_name
 
 
-def plot_tree_heatmap(mdist, roary, roary_sorted, tree, tree_name, outprefix):
+def plot_tree_heatmap(mdist, roary, cluster_order, strain_order, tree,
+                      tree_name, outprefix):
 
     # Plot presence/absence matrix against the tree
     with sns.axes_style('whitegrid'):
         fig = plt.figure(figsize=(17, 10))
 
         ax1 = plt.subplot2grid((1, 40), (0, 10), colspan=30)
-        a = ax1.matshow(roary_sorted.T, cmap=plt.cm.Blues,
-                        vmin=0, vmax=1,
-                        aspect='auto',
-                        interpolation='none',
-                        )
+        # Draw at most one matrix cell per pixel, strains are the rows
+        bbox = ax1.get_window_extent()
+        binned = bin_presence(roary, cluster_order, strain_order,
+                              int(np.ceil(bbox.width)),
+                              int(np.ceil(bbox.height)))
+        a = ax1.imshow(binned.T, cmap=plt.cm.Blues,
+                       vmin=0, vmax=1,
+                       aspect='auto',
+                       interpolation='nearest',
+                       rasterized=True,
+                       )
 
         # Creates an outline around the heatmap
         ax1.set_yticks([])
         ax1.set_xticks([])
 
         # Adjust colspan if strain names overlap heatmap
-        ax = plt.subplot2grid((1, 40), (0, 0), colspan=7, axisbg='white')
+        ax = plt.subplot2grid((1, 40), (0, 0), colspan=7, facecolor='white')
 
         fig.subplots_adjust(wspace=0, hspace=0)
 
@@ -173,35 +210,43 @@ def plot_tree_heatmap(mdist, roary, roary_sorted, tree, tree_name, outprefix):
         plt.clf()
 
 
-def main():
-    options = get_options()
-    outprefix = options.out_dir + '/' + options.nickname + '_'
-
+def make_all_plots(tree_file, roary, strain_names, outprefix):
+    # Makes the frequency plot, tree heat map and pie chart for one run from
+    # its newick file and boolean cluster x strain presence matrix
     sns.set_style('white')
 
-    tree = Phylo.read(options.tree, 'newick')
+    # Phylo.draw needs the parsed tree even when the tip information below
+    # comes from tree_reader's cache
+    tree = Phylo.read(tree_file, 'newick')
 
-    tree_name = get_tree_name(options)
+    tree_name = get_tree_name(tree_file)
 
-    # Max distance to create better plots
-    mdist = max([tree.distance(tree.root, x) for x in tree.get_terminals()])
+    # Tip order and max distance to create better plots
+    tree_info = tr.read_tree_info(tree_file, tree)
+    mdist = max(tree_info.tip_depths)
 
-    roary = get_roary_data(options)
-
-    # Sort the matrix by the sum of strains presence
-    idx = roary.sum(axis=1).order(ascending=False).index
-    roary_sorted = roary.ix[idx]
+    # Sort the clusters by the number of strains that have them
+    cluster_order = np.argsort(-np.sum(roary, axis=1), kind='mergesort')
 
     make_freq_plot(roary, outprefix)
 
-    # Sort the matrix according to tip labels in the tree
-    roary_sorted = roary_sorted[[x.name for x in tree.get_terminals()]]
+    # Sort the strains according to tip labels in the tree
+    strain_index = dict((name, i) for i, name in enumerate(strain_names))
+    strain_order = np.array([strain_index[x] for x in tree_info.tip_names],
+                            dtype=np.intp)
 
-    plot_tree_heatmap(mdist, roary, roary_sorted, tree, tree_name,
-                      outprefix)
+    plot_tree_heatmap(mdist, roary, cluster_order, strain_order, tree,
+                      tree_name, outprefix)
 
     make_pie_chart(roary, outprefix)
 
 
+def main():
+    options = get_options()
+    outprefix = options.out_dir + '/' + options.nickname + '_'
+    roary, strain_names = get_roary_data(options)
+    make_all_plots(options.tree, roary, strain_names, outprefix)
+
+
 if __name__ == "__main__":
     main()
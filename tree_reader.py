@@ -0,0 +1,112 @@
+"""
+Shared tip information for newick trees
+One depth first pass over the tree gives the tips in drawing order (the order
+of Bio.Phylo's get_terminals) and each tip's distance from the root, without
+walking from the root again for every tip.  The result is saved in a hidden
+sidecar file next to the newick file, keyed on the file's sha1, so later runs
+skip the traversal.  It doesn't save parsing the newick file for scripts that
+also draw the tree (tree_heatmap.py needs the parsed tree for Phylo.draw), only
+for callers that need nothing but the tips and pass no tree.
+"""
+import hashlib
+import json
+import os
+from collections import namedtuple
+from lazy_import import LazyModule
+
+Phylo = LazyModule('Bio.Phylo')
+
+# Tip names in get_terminals order and their distances from the root
+TreeInfo = namedtuple('TreeInfo', ['tip_names', 'tip_depths'])
+
+# Bump when the sidecar layout changes so old caches are rebuilt
+CACHE_VERSION = 1
+
+
+# Input is a Bio.Phylo tree
+# Returns its TreeInfo.  Missing branch lengths count as 0 and the root's own
+# branch length is not included, as in tree.distance(tree.root, tip).
+def traverse(tree):
+    tip_names = list()
+    tip_depths = list()
+    stack = [(tree.root, 0.0)]
+    while stack:
+        clade, depth = stack.pop()
+        if clade.is_terminal():
+            tip_names.append(clade.name)
+            tip_depths.append(depth)
+            continue
+        # Pushed in reverse so the first child is visited first
+        for child in reversed(clade.clades):
+            stack.append((child, depth + (child.branch_length or 0.0)))
+    return TreeInfo(tip_names, tip_depths)
+
+
+# Input is the path to a file
+# Returns the sha1 of its contents
+def get_file_hash(file_path):
+    sha = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+# Input is the path to a newick file
+# Returns the path of its sidecar cache file
+def get_cache_path(newick_path):
+    folder, name = os.path.split(os.path.abspath(newick_path))
+    return os.path.join(folder, '.' + name + '.tips.json')
+
+
+# Inputs are the path to a newick file and the hash of its contents
+# Returns the TreeInfo in its sidecar or None if there is none for this hash
+def read_cache(newick_path, file_hash):
+    try:
+        with open(get_cache_path(newick_path), 'r') as f:
+            cache = json.load(f)
+        if cache['version'] != CACHE_VERSION or cache['sha1'] != file_hash:
+            return None
+        return TreeInfo(cache['tip_names'], cache['tip_depths'])
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+# Inputs are the path to a newick file, the hash of its contents and its
+# TreeInfo
+# Writes the sidecar through a temporary file renamed into place
+def write_cache(newick_path, file_hash, info):
+    cache_path = get_cache_path(newick_path)
+    tmp_path = cache_path + '.tmp%d' % os.getpid()
+    cache = {'version': CACHE_VERSION, 'sha1': file_hash,
+             'tip_names': info.tip_names, 'tip_depths': info.tip_depths}
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(cache, f)
+        os.rename(tmp_path, cache_path)
+    finally:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+
+
+# Inputs are the path to a newick file, the tree already read from it (if the
+# caller has it) and whether to use the sidecar cache
+# Returns the tree's TreeInfo, from the cache when the file is unchanged.
+# Otherwise the tree is traversed (and read if needed) and the cache
+# rewritten.  A folder that can't be written to just means no cache.
+def read_tree_info(newick_path, tree=None, use_cache=True):
+    if use_cache:
+        file_hash = get_file_hash(newick_path)
+        info = read_cache(newick_path, file_hash)
+        if info is not None:
+            return info
+
+    if tree is None:
+        tree = Phylo.read(newick_path, 'newick')
+    info = traverse(tree)
+    if use_cache:
+        try:
+            write_cache(newick_path, file_hash, info)
+        except (IOError, OSError):
+            pass
+    return info